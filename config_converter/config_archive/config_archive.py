@@ -0,0 +1,271 @@
+"""Reads fluentd config bundles from archives and writes archived outputs.
+
+Supported formats are tar (optionally gzip, bzip2 or xz compressed) and zip,
+picked by file extension. Input archives are read without extracting
+anything to disk, and @include directives are resolved against the other
+members of the same archive.
+
+Zip and uncompressed tar archives are indexed by member offset, and members
+are read one at a time as they are needed. Compressed tar archives cannot be
+read at an offset without decompressing everything before it, so they are
+decompressed in a single streaming pass and their members are held in
+memory, up to a limit.
+"""
+
+import collections.abc
+import fnmatch
+import io
+import posixpath
+import re
+import tarfile
+import zipfile
+from config_converter.config_io import config_io
+
+_TAR_SUFFIXES = {
+    '.tar': '',
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tbz2': 'bz2',
+    '.tar.xz': 'xz',
+    '.txz': 'xz'
+}
+# matches "@include path" (and the deprecated "include path") lines
+_INCLUDE_RE = re.compile(r'^\s*@?include\s+(.+?)\s*$')
+
+
+def _tar_compression(path: str) -> str:
+    """Returns compression of a tar path, None if path is not a tar."""
+    for suffix, compression in _TAR_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def is_archive(path: str) -> bool:
+    """Checks if path names a supported archive, by extension."""
+    return path.endswith('.zip') or _tar_compression(path) is not None
+
+
+class ArchiveError(Exception):
+    """Raised when an input archive cannot be read within the limits."""
+
+
+class ArchiveMembers(collections.abc.Mapping):
+    """The regular file members of an archive, by normalized name.
+
+    Members of zip and uncompressed tar archives are read from the archive
+    when looked up. Members of compressed tar archives are all read when
+    it is opened, and must not add up to more than max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30):
+        self._archive = None
+        self._index = dict()
+        if path.endswith('.zip'):
+            self._archive = zipfile.ZipFile(path)
+            for info in self._archive.infolist():
+                if not info.is_dir():
+                    self._index[posixpath.normpath(info.filename)] = info
+        elif not _tar_compression(path):
+            self._archive = tarfile.open(path, 'r:')
+            for info in self._archive.getmembers():
+                if info.isfile():
+                    self._index[posixpath.normpath(info.name)] = info
+        else:
+            self._read_stream(path, max_bytes)
+
+    def _read_stream(self, path: str, max_bytes: int) -> None:
+        """Reads every member of a compressed tar archive in one pass."""
+        total = 0
+        with tarfile.open(path, f'r|{_tar_compression(path)}') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                total += info.size
+                if total > max_bytes:
+                    raise ArchiveError(
+                        f'{path} holds more than {max_bytes} bytes, '
+                        'decompress it or raise --max_archive_bytes')
+                self._index[posixpath.normpath(info.name)] = \
+                        archive.extractfile(info).read()
+
+    def __getitem__(self, name: str) -> bytes:
+        member = self._index[name]
+        if isinstance(self._archive, zipfile.ZipFile):
+            return self._archive.read(member)
+        if self._archive is not None:
+            return self._archive.extractfile(member).read()
+        return member
+
+    def __contains__(self, name) -> bool:
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def close(self) -> None:
+        """Closes the archive."""
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_members(path: str, max_bytes: int = 1 << 30) -> ArchiveMembers:
+    """Opens the regular file members of an archive, see ArchiveMembers.
+
+    Raises:
+        ArchiveError: A compressed tar archive holds more than max_bytes.
+    """
+    return ArchiveMembers(path, max_bytes)
+
+
+def _glob_match(name: str, pattern: str) -> bool:
+    """Checks if a member name matches a glob pattern.
+
+    Like a filesystem glob, wildcards do not match across '/', and a '**'
+    component matches any number of directories (including none).
+    """
+    return _match_parts(name.split('/'), pattern.split('/'))
+
+
+def _match_parts(names: list, patterns: list) -> bool:
+    """Matches path components of a name against pattern components."""
+    if not patterns:
+        return not names
+    if patterns[0] == '**':
+        return any(
+            _match_parts(names[i:], patterns[1:])
+            for i in range(len(names) + 1))
+    return bool(names) and fnmatch.fnmatchcase(
+        names[0], patterns[0]) and _match_parts(names[1:], patterns[1:])
+
+
+def include_target(line: str) -> str:
+    """Returns the target of an @include line, None for other lines and
+    for includes that are not file paths (e.g. http urls).
+
+    Like fluentd, the target ends at a '#', which starts a comment.
+    """
+    match = _INCLUDE_RE.match(line)
+    if not match:
+        return None
+    target = match.group(1).split('#', 1)[0].strip().strip('"\'')
+    if not target or '://' in target:
+        return None
+    return target
+
+
+def _resolve_include(members: collections.abc.Mapping, base_dir: str,
+                     target: str) -> list:
+    """Returns sorted member names an include target refers to.
+
+    Relative targets are resolved against the including member's directory,
+    absolute targets against the archive root. Glob patterns are matched
+    against member names the same way fluentd globs the filesystem.
+    """
+    if target.startswith('/'):
+        pattern = posixpath.normpath(target.lstrip('/'))
+    else:
+        pattern = posixpath.normpath(posixpath.join(base_dir, target))
+    if not any(c in pattern for c in '*?['):
+        return [pattern] if pattern in members else []
+    return sorted(name for name in members if _glob_match(name, pattern))
+
+
+class IncludeError(Exception):
+    """Raised when include expansion cycles or exceeds a limit."""
+
+
+def expand_includes(members: collections.abc.Mapping,
+                    name: str,
+                    max_depth: int = 32,
+                    max_bytes: int = 64 << 20,
+                    max_files: int = 1000) -> str:
+    """Returns the text of member name with @include lines expanded inline.
+
+    Includes that are not file paths (e.g. http urls) are kept as they are,
+    so the parser handles them like it would for a config on disk.
+
+    Raises:
+        IncludeError: Includes form a cycle, are nested deeper than
+          max_depth, or expand to more than max_files files or max_bytes
+          bytes in total.
+    """
+    state = {'stack': [], 'files': 0, 'bytes': 0}
+    limits = {
+        'max_depth': max_depth,
+        'max_bytes': max_bytes,
+        'max_files': max_files
+    }
+    return _expand_member(members, name, state, limits)
+
+
+def _expand_member(members: collections.abc.Mapping, name: str, state: dict,
+                   limits: dict) -> str:
+    """Expands includes of one member, tracking limits in state."""
+    if name in state['stack']:
+        raise IncludeError(
+            f'include cycle: {" -> ".join(state["stack"] + [name])}')
+    if len(state['stack']) > limits['max_depth']:
+        raise IncludeError(
+            f'includes nested deeper than {limits["max_depth"]}')
+    content = members[name]
+    state['files'] += 1
+    state['bytes'] += len(content)
+    if state['files'] > limits['max_files']:
+        raise IncludeError(
+            f'more than {limits["max_files"]} included files')
+    if state['bytes'] > limits['max_bytes']:
+        raise IncludeError(
+            f'includes expand to more than {limits["max_bytes"]} bytes')
+    state['stack'].append(name)
+    lines = []
+    for line in content.decode('utf-8').splitlines(keepends=True):
+        target = include_target(line)
+        if target is None:
+            lines.append(line)
+            continue
+        for included in _resolve_include(members, posixpath.dirname(name),
+                                         target):
+            lines.append(_expand_member(members, included, state, limits))
+            lines.append('\n')
+    state['stack'].pop()
+    return ''.join(lines)
+
+
+def config_names(members: collections.abc.Mapping, pattern: str) -> list:
+    """Returns sorted member names matching pattern to convert."""
+    return sorted(name for name in members if _glob_match(name, pattern)
+                  and not name.startswith(('/', '../')))
+
+
+def write_archive(path: str, members: dict) -> None:
+    """Writes members (name to bytes) into a new archive at path.
+
+    The archive replaces path atomically, see config_io.
+    """
+    with config_io.atomic_write(path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            if path.endswith('.zip'):
+                with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    for name, content in sorted(members.items()):
+                        archive.writestr(name, content)
+            else:
+                with tarfile.open(fileobj=f,
+                                  mode=f'w|{_tar_compression(path)}') as \
+                        archive:
+                    for name, content in sorted(members.items()):
+                        info = tarfile.TarInfo(name)
+                        info.size = len(content)
+                        info.mode = 0o644
+                        archive.addfile(info, io.BytesIO(content))
@@ -0,0 +1,179 @@
+"""Migrates fluentd in_tail pos files to master agent checkpoint files.
+
+A fluentd pos file has one line per tailed file:
+    <path>\\t<offset in hex>\\t<inode in hex>
+The master agent tails files with fluent-bit, which keeps its checkpoints in
+an sqlite database with one in_tail_files row per file. An offset is only
+carried over while the file at its path still has the same inode and is not
+shorter than the offset, so a rotated or truncated file is read from its
+start rather than from a position that belongs to another file.
+
+A checkpoint that already exists is never replaced unless asked to: once
+the master agent runs, it holds the agent's own offsets, which are newer
+than those of fluentd.
+"""
+
+import collections
+import mmap
+import os
+import re
+import sqlite3
+import time
+from config_converter.config_io import config_io
+
+_POS_ENTRY_RE = re.compile(rb'^([^\t\n]+)\t([0-9a-fA-F]+)\t([0-9a-fA-F]+)',
+                           re.MULTILINE)
+# offset fluentd writes for files it stopped tailing
+_UNWATCHED_OFFSET = 0xffffffffffffffff
+# schema of the fluent-bit tail plugin database
+_CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS in_tail_files (
+    id      INTEGER PRIMARY KEY,
+    name    TEXT NOT NULL,
+    offset  INTEGER,
+    inode   INTEGER,
+    created INTEGER,
+    rotated INTEGER DEFAULT 0
+);
+"""
+
+PosEntry = collections.namedtuple('PosEntry', ['path', 'offset', 'inode'])
+
+
+def read_pos_file(path: str) -> list:
+    """Returns the PosEntry of each file tailed in the pos file at path.
+
+    The file is mapped rather than read line by line. Like fluentd, lines
+    it cannot parse and files no longer tailed are ignored, and when a path
+    appears twice the latest entry wins.
+    """
+    entries = dict()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in _POS_ENTRY_RE.finditer(data):
+                offset = int(match.group(2), 16)
+                if offset == _UNWATCHED_OFFSET:
+                    continue
+                file_path = os.fsdecode(match.group(1))
+                entries[file_path] = PosEntry(file_path, offset,
+                                              int(match.group(3), 16))
+    return list(entries.values())
+
+
+def check_entry(entry: PosEntry) -> str:
+    """Returns why entry cannot be carried over, or None if it can."""
+    try:
+        info = os.stat(entry.path)
+    except OSError:
+        return 'missing'
+    if info.st_ino != entry.inode:
+        return 'rotated'
+    if info.st_size < entry.offset:
+        return 'truncated'
+    return None
+
+
+def write_checkpoint(path: str, entries: list) -> None:
+    """Writes entries to a new checkpoint database at path atomically."""
+    with config_io.atomic_write(path) as tmp_path:
+        db = sqlite3.connect(tmp_path)
+        try:
+            with db:
+                db.executescript(_CHECKPOINT_SCHEMA)
+                created = int(time.time())
+                db.executemany(
+                    'INSERT INTO in_tail_files (name, offset, inode, created)'
+                    ' VALUES (?, ?, ?, ?)',
+                    [(entry.path, entry.offset, entry.inode, created)
+                     for entry in entries])
+        finally:
+            db.close()
+
+
+def checkpoint_name(pos_path: str) -> str:
+    """Returns the file name of the checkpoint migrated from pos_path, unique
+    across pos files of different directories."""
+    return os.path.normpath(pos_path).strip(os.sep).replace(os.sep,
+                                                            '_') + '.db'
+
+
+def migrate_pos_file(pos_path: str,
+                     checkpoint_path: str,
+                     write: bool = True) -> dict:
+    """Migrates the offsets of a pos file to a checkpoint database.
+
+    Without write, only reports what would be migrated.
+
+    Returns:
+        A dict with the number of offsets migrated, and the reason each
+        skipped file could not be migrated.
+
+    Raises:
+        OSError: The pos file could not be read, or the checkpoint written.
+    """
+    migrated = []
+    skipped = dict()
+    for entry in read_pos_file(pos_path):
+        reason = check_entry(entry)
+        if reason is None:
+            migrated.append(entry)
+        else:
+            skipped[entry.path] = reason
+    if write:
+        write_checkpoint(checkpoint_path, migrated)
+    return {'files_migrated': len(migrated), 'files_skipped': skipped}
+
+
+def migrate_sources(result: dict,
+                    checkpoint_dir: str,
+                    stats: dict,
+                    overwrite: bool = False,
+                    write: bool = True) -> None:
+    """Migrates the pos file of every source of a master agent config.
+
+    The checkpoint_file of each source is pointed at its checkpoint in
+    checkpoint_dir. A checkpoint that already exists is kept, unless
+    overwrite is set, and without write nothing is written, only reported.
+    Totals are added to stats, along with a 'checkpoints' list holding the
+    result of each source.
+    """
+    if write:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    stats.update({
+        'checkpoints_migrated': 0,
+        'checkpoints_kept': 0,
+        'checkpoints_failed': 0,
+        'checkpoint_files_migrated': 0,
+        'checkpoint_files_skipped': 0,
+        'checkpoints': []
+    })
+    for source in result['logs_module'].get('sources', []):
+        config = source.get('file_source_config', dict())
+        if 'checkpoint_file' not in config:
+            continue
+        pos_path = config['checkpoint_file']
+        checkpoint_path = os.path.join(checkpoint_dir,
+                                       checkpoint_name(pos_path))
+        report = {
+            'source': source.get('name'),
+            'pos_file': pos_path,
+            'checkpoint_file': checkpoint_path
+        }
+        stats['checkpoints'].append(report)
+        if not overwrite and os.path.exists(checkpoint_path):
+            report['kept'] = 'checkpoint exists'
+            config['checkpoint_file'] = checkpoint_path
+            stats['checkpoints_kept'] += 1
+            continue
+        try:
+            report.update(migrate_pos_file(pos_path, checkpoint_path, write))
+        except (OSError, sqlite3.Error) as e:
+            report['error'] = str(e)
+            stats['checkpoints_failed'] += 1
+        else:
+            config['checkpoint_file'] = checkpoint_path
+            stats['checkpoints_migrated'] += 1
+            stats['checkpoint_files_migrated'] += report['files_migrated']
+            stats['checkpoint_files_skipped'] += len(report['files_skipped'])
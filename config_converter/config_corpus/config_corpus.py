@@ -0,0 +1,114 @@
+"""Finds golden fixtures of the converter and diffs them structurally.
+
+A corpus is a directory tree of fluentd configs, each next to the master
+agent config it must convert to:
+    <name>.conf        the fluentd config
+    <name>.yaml        the expected master agent config
+    <name>.stats.json  optionally, the expected stats of the conversion
+A .conf without a .yaml, such as a file other configs include, is not a
+fixture. Outputs are compared as parsed yaml, so formatting does not matter
+and differences are reported by key path.
+"""
+
+import collections
+import json
+import os
+import yaml
+from config_converter.config_mapper import config_mapper
+
+
+class FixtureError(Exception):
+    """Raised when the expected output of a fixture cannot be read."""
+
+
+Fixture = collections.namedtuple('Fixture',
+                                 ['name', 'config_path', 'yaml_path',
+                                  'stats_path'])
+
+
+def find_fixtures(corpus_dir: str) -> list:
+    """Returns the Fixture of every config of corpus_dir, sorted by name.
+
+    Names are the config paths relative to corpus_dir without extension.
+    """
+    fixtures = []
+    for (directory, dirs, files) in os.walk(corpus_dir):
+        dirs.sort()
+        for file_name in files:
+            (stem, extension) = os.path.splitext(file_name)
+            if extension != '.conf' or f'{stem}.yaml' not in files:
+                continue
+            stats_path = os.path.join(directory, f'{stem}.stats.json')
+            fixtures.append(
+                Fixture(
+                    os.path.relpath(os.path.join(directory, stem),
+                                    corpus_dir),
+                    os.path.join(directory, file_name),
+                    os.path.join(directory, f'{stem}.yaml'),
+                    stats_path if os.path.isfile(stats_path) else None))
+    return sorted(fixtures)
+
+
+def _key_path(path: str, key) -> str:
+    """Returns the key path of key within the value at path."""
+    if isinstance(key, int):
+        return f'{path}[{key}]'
+    return f'{path}.{key}' if path else str(key)
+
+
+def diff_values(expected, observed, path: str = '') -> list:
+    """Returns the differences of observed from expected, one line per
+    differing leaf, prefixed with its key path (e.g. a.b[0].c)."""
+    if isinstance(expected, dict) and isinstance(observed, dict):
+        diffs = []
+        for key in sorted(set(expected) | set(observed), key=str):
+            key_path = _key_path(path, key)
+            if key not in observed:
+                diffs.append(f'{key_path}: missing, expected '
+                             f'{expected[key]!r}')
+            elif key not in expected:
+                diffs.append(f'{key_path}: unexpected {observed[key]!r}')
+            else:
+                diffs += diff_values(expected[key], observed[key], key_path)
+        return diffs
+    if isinstance(expected, list) and isinstance(observed, list):
+        diffs = []
+        for (index, (expected_item, observed_item)) in enumerate(
+                zip(expected, observed)):
+            diffs += diff_values(expected_item, observed_item,
+                                 _key_path(path, index))
+        for index in range(len(observed), len(expected)):
+            diffs.append(f'{_key_path(path, index)}: missing, expected '
+                         f'{expected[index]!r}')
+        for index in range(len(expected), len(observed)):
+            diffs.append(
+                f'{_key_path(path, index)}: unexpected {observed[index]!r}')
+        return diffs
+    if expected != observed:
+        return [f'{path or "<root>"}: expected {expected!r}, got {observed!r}']
+    return []
+
+
+def check_fixture(fixture: Fixture, yaml_dict: dict, stats: dict) -> list:
+    """Returns the differences of a conversion from its fixture.
+
+    yaml_dict is compared as it would be written, dumped and loaded back.
+
+    Raises:
+        FixtureError: The expected yaml or stats cannot be read or parsed.
+    """
+    try:
+        with open(fixture.yaml_path, 'rt') as f:
+            expected = yaml.safe_load(f)
+        if fixture.stats_path is not None:
+            with open(fixture.stats_path, 'rt') as f:
+                expected_stats = json.load(f)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        # yaml errors span lines, reports keep each difference on one
+        raise FixtureError(
+            f'invalid fixture {fixture.name}: {" ".join(str(e).split())}')
+    diffs = diff_values(expected,
+                        yaml.safe_load(config_mapper.dump_yaml(yaml_dict)))
+    if fixture.stats_path is not None:
+        diffs += diff_values(expected_stats, stats, 'stats')
+    return diffs
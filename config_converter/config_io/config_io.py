@@ -0,0 +1,58 @@
+"""Atomic and durable replacement of output files.
+
+Every file the converter writes (master agent configs, archives, shard
+results and checkpoints) is written to a temp file in the target directory,
+fsynced, given the permissions of the file it replaces and renamed over it,
+then the directory is fsynced. Readers never see a partial file, and the
+new file survives a crash once the write returns.
+"""
+
+import contextlib
+import os
+import tempfile
+
+
+def new_file_mode() -> int:
+    """Returns the permission bits open() would give a new file."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _fsync_path(path: str) -> None:
+    """Flushes the file or directory at path to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str):
+    """Replaces the file at path with what the block writes to a temp path.
+
+    Yields:
+        The temp path to write the new content to. The file exists (empty)
+        and may be written by name, e.g. by sqlite. If the block raises,
+        the temp file is removed and path is left untouched.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = new_file_mode()
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix=f'.{os.path.basename(path)}.',
+                                    suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_path
+        _fsync_path(tmp_path)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    _fsync_path(directory)
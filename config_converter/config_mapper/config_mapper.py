@@ -10,6 +10,8 @@ Where:
     config json: string of fluentd config parsed into a json format
 """
 
+import difflib
+import hashlib
 import json
 import logging
 import os
@@ -17,6 +19,7 @@ import sys
 from pathlib import Path
 import yaml
 from google.protobuf import json_format
+from config_converter.config_io import config_io
 from config_converter.config_mapper import config_pb2
 
 # fields we cannot convert from fluentd to master agent configs
@@ -29,6 +32,8 @@ _UNSUPPORTED_FIELDS = [
 ]
 # plugins we know how to convert
 _SUPPORTED_PLUGINS = ['in_tail']
+# plugin name prefix of each root directive we can map
+_PLUGIN_PREFIX_MAP = {'source': 'in_'}
 
 
 def _initialize_stats(directive: config_pb2.Directive) -> dict:
@@ -73,11 +78,10 @@ def extract_root_dirs(config_obj: config_pb2.Directive) -> tuple:
     logs_module = dict()
     result = {'logs_module': logs_module}
     stats = _initialize_stats(config_obj)
-    plugin_prefix_map = {'source': 'in_'}
     dir_name_map = {'source': 'sources'}
     # these dicts can be updated when more plugins are supported
     for directive in config_obj.directives:
-        if directive.name not in plugin_prefix_map:
+        if directive.name not in _PLUGIN_PREFIX_MAP:
             stats['entities_skipped'] += 1
             stats['attributes_skipped'] += _get_aggregated_num_attributes(
                 directive)
@@ -93,7 +97,7 @@ def extract_root_dirs(config_obj: config_pb2.Directive) -> tuple:
             logging.error('Invalid configuration - missing @type param')
             stats['error_logs'] += 1
             sys.exit()
-        plugin_name = plugin_prefix_map[directive.name] + plugin_type
+        plugin_name = _PLUGIN_PREFIX_MAP[directive.name] + plugin_type
         if plugin_name not in _SUPPORTED_PLUGINS:
             stats['entities_unrecognized'] += 1
             stats['attributes_unrecognized'] += _get_aggregated_num_attributes(
@@ -127,6 +131,25 @@ def extract_root_dirs(config_obj: config_pb2.Directive) -> tuple:
     return (result, stats)
 
 
+def needs_mapping(config_obj: config_pb2.Directive) -> bool:
+    """Checks if extract_root_dirs could map anything of config_obj.
+
+    True if a root directive uses a supported plugin, or lacks the @type
+    needed to tell; configs for which this is False convert to an empty
+    logs_module.
+    """
+    for directive in config_obj.directives:
+        if directive.name not in _PLUGIN_PREFIX_MAP:
+            continue
+        plugin_types = [
+            param.value for param in directive.params if param.name == '@type'
+        ]
+        if not plugin_types or (_PLUGIN_PREFIX_MAP[directive.name] +
+                                plugin_types[0] in _SUPPORTED_PLUGINS):
+            return True
+    return False
+
+
 def _convert_plugin(directive: config_pb2.Directive, plugin: str,
                     stats: dict) -> dict:
     """Returns dict of mapped fields and values.
@@ -286,10 +309,82 @@ def _convert_parse_dir(specific: dict, param: config_pb2.Param) -> None:
                     = param.value
 
 
-def write_to_yaml(result: dict, path: str, name: str) -> None:
-    """Writes created result dictionary to a yaml file."""
-    with open(f'{path}/{name}.yaml', 'w') as f:
-        yaml.dump(result, f)
+def convert_config(config_json: str, agent_log_level: str,
+                   agent_log_dirpath: str) -> tuple:
+    """Maps a parsed fluentd config json string to a master agent config.
+
+    Returns:
+        A tuple of the master agent config dict and the stats dict.
+    """
+    return convert_directive(
+        json_format.Parse(config_json, config_pb2.Directive()),
+        agent_log_level, agent_log_dirpath)
+
+
+def convert_directive(config_obj: config_pb2.Directive, agent_log_level: str,
+                      agent_log_dirpath: str) -> tuple:
+    """Maps a parsed fluentd config to a master agent config.
+
+    Returns:
+        A tuple of the master agent config dict and the stats dict.
+    """
+    (result, stats) = extract_root_dirs(config_obj)
+    result['logging_level'] = result.get('logging_level', agent_log_level)
+    result['log_file_path'] = agent_log_dirpath
+    return (result, stats)
+
+
+def dump_yaml(result: dict) -> str:
+    """Returns the yaml text for a created result dictionary."""
+    return yaml.dump(result)
+
+
+def _file_digest(path: str) -> str:
+    """Returns sha256 hex digest of the file at path, empty if missing."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return ''
+    return digest.hexdigest()
+
+
+def diff_yaml(result: dict, path: str, name: str) -> list:
+    """Returns unified diff lines between {path}/{name}.yaml and result."""
+    target = f'{path}/{name}.yaml'
+    try:
+        with open(target, 'rt') as f:
+            current = f.read().splitlines(keepends=True)
+    except FileNotFoundError:
+        current = []
+    return list(
+        difflib.unified_diff(current,
+                             dump_yaml(result).splitlines(keepends=True),
+                             fromfile=target,
+                             tofile=target))
+
+
+def write_to_yaml(result: dict, path: str, name: str) -> bool:
+    """Writes created result dictionary to a yaml file.
+
+    The write is skipped when the existing file already has the same
+    content, so its mtime only moves when the config really changed.
+    Otherwise the file is replaced atomically, see config_io.
+
+    Returns:
+        True if the file was written, False if it was already up to date.
+    """
+    content = dump_yaml(result).encode()
+    target = f'{path}/{name}.yaml'
+    if _file_digest(target) == hashlib.sha256(content).hexdigest():
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with config_io.atomic_write(target) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+    return True
 
 
 def initialize_logger(level: str, path: str) -> None:
@@ -307,10 +402,7 @@ if __name__ == '__main__':
     log_filepath, agent_log_level = sys.argv[4], sys.argv[5]
     agent_log_dirpath, config_json = sys.argv[6], sys.argv[7]
     initialize_logger(log_level, log_filepath)
-    (yaml_dict, stats_output) = extract_root_dirs(
-        json_format.Parse(config_json, config_pb2.Directive()))
-    yaml_dict['logging_level'] = yaml_dict.get('logging_level',
-                                               agent_log_level)
-    yaml_dict['log_file_path'] = agent_log_dirpath
+    (yaml_dict, stats_output) = convert_config(config_json, agent_log_level,
+                                               agent_log_dirpath)
     write_to_yaml(yaml_dict, agent_path, file_name)
     print(json.dumps(stats_output, indent=2))
@@ -0,0 +1,50 @@
+# frozen_string_literal: true
+
+require 'benchmark'
+require 'config_parser'
+require 'tmpdir'
+
+# Parses many top level configs sharing large include fragments, modeled on
+# test/data/in_tail_include.conf scaled up, with and without include cache.
+#
+# Usage: rake bench [CONFIGS=n] [SOURCES=n]
+module IncludeCacheBench
+  DATA_DIR = File.expand_path('../../../test/data', __dir__)
+
+  # writes fragments repeating the included fixtures, and top level configs
+  # including them like in_tail_include.conf does
+  def self.write_fixtures(dir, configs, sources)
+    %w[in_tail_deprecated in_tail_unknown].each do |name|
+      File.write("#{dir}/#{name}.conf", File.read("#{DATA_DIR}/#{name}.conf") * sources)
+    end
+    include_conf = File.read("#{DATA_DIR}/in_tail_include.conf")
+    Array.new(configs) do |i|
+      path = "#{dir}/config_#{i}.conf"
+      File.write(path, include_conf)
+      path
+    end
+  end
+
+  def self.run(paths, cache)
+    Benchmark.realtime do
+      paths.each { |path| ConfigParser.proto_config(ConfigParser.parse_config(path, IncludeLimits.default, cache)) }
+    end
+  end
+
+  def self.main
+    configs = Integer(ENV.fetch('CONFIGS', '200'))
+    sources = Integer(ENV.fetch('SOURCES', '50'))
+    Dir.mktmpdir do |dir|
+      paths = write_fixtures(dir, configs, sources)
+      uncached = run(paths, nil)
+      cache = IncludeCache.new
+      cached = run(paths, cache)
+      puts format('%<configs>d configs, %<sources>d sources per fragment', configs: configs, sources: sources)
+      puts format('no cache: %<time>.3fs', time: uncached)
+      puts format('cache:    %<time>.3fs (%<hits>d hits, %<misses>d misses), %<speedup>.1fx faster',
+                  time: cached, hits: cache.hits, misses: cache.misses, speedup: uncached / cached)
+    end
+  end
+end
+
+IncludeCacheBench.main if $PROGRAM_NAME == __FILE__
@@ -3,17 +3,26 @@
 require 'fluent/config/v1_parser'
 require 'optparse'
 require_relative 'config_pb'
+require_relative 'config_parser_server'
+require_relative 'guarded_parser'
+require_relative 'parser_options'
 
 # Accepts a file path and prints out parsed version
 class ConfigParser
   def initialize(argv = ARGV)
     @argv = argv
+    @options = ParserOptions.new
     prepare_input_parser
+    return ConfigParserServer.new(@options).serve if @options.serve?
+
     input_validation
-    @file_parse = ConfigParser.parse_config(@argv[0])
+    @file_parse = parse_input
     @proto_obj = ConfigParser.proto_config(@file_parse)
     File.write(@argv[1].to_s + '/config.json',
                Config::Directive.encode_json(@proto_obj))
+  rescue Fluent::ConfigParseError => e
+    warn "Error: #{@argv[0]}: #{e.message}"
+    exit(false)
   end
 
   # builds the parser to accept file path
@@ -21,13 +30,21 @@ class ConfigParser
     @input_parser = OptionParser.new
     @input_parser.banner = "\nConfig Migration Tool\nArguments: " \
       "path/to/config/file path/to/output/directory\nOutput: Parsed version " \
-      'of config file in a json file'
+      "of config file in a json file\nWith --serve, reads config paths, or " \
+      'json objects with the name and config text, from standard input and ' \
+      'answers each with a line of json'
+    @options.define(@input_parser)
     @input_parser.parse!(@argv)
   rescue StandardError => e
     usage(e)
     exit(false)
   end
 
+  # parses the config file under the watchdog
+  def parse_input
+    @options.watchdog.watch { ConfigParser.parse_config(@argv[0], @options.limits) }
+  end
+
   # explains how to run the file
   def usage(message = nil)
     puts @input_parser.to_s
@@ -46,16 +63,20 @@ class ConfigParser
   end
 
   # extracts required information and parses the config file
-  def self.parse_config(path)
-    file_str = File.read(path)
-    file_name = File.basename(path)
-    file_dir = File.dirname(path)
+  def self.parse_config(path, limits = IncludeLimits.default, cache = nil)
+    state = IncludeState.new(limits, cache)
+    state.enter(File.realpath(path))
+    parse_string(File.read(path), File.basename(path), File.dirname(path), state)
+  end
+
+  # parses config text, resolving relative includes against file_dir
+  def self.parse_string(file_str, file_name, file_dir, state = IncludeState.new)
     eval_context = Kernel.binding
     # overriding function so embedded ruby is not parsed
     def eval_context.instance_eval(code)
       code
     end
-    Fluent::Config::V1Parser.parse(file_str, file_name, file_dir, eval_context)
+    GuardedParser.parse(file_str, file_name, file_dir, eval_context, state)
   end
 
   # stores name, attributes, elements of each element of config with proto
@@ -0,0 +1,47 @@
+# frozen_string_literal: true
+
+require 'json'
+
+# Parses config after config in one process, sparing the ruby and fluentd
+# startup for each. Configs requested by path share the include cache; the
+# text of a request has its includes expanded by the caller, so the cache is
+# not used for it. Errors of a config are reported in its answer instead of
+# ending the process.
+class ConfigParserServer
+  def initialize(options)
+    @options = options
+  end
+
+  # answers each request read from input with a line of json, holding
+  # either the parsed config or the error, so callers keep a warm parser
+  def serve(input = $stdin, output = $stdout)
+    output.sync = true
+    input.each_line { |line| output.puts(JSON.generate(answer(line.chomp))) }
+  end
+
+  # a request is a config path, or a json object with the name and the text
+  # of a config, e.g. one read from an archive
+  def answer(request)
+    return parse_one(request) unless request.start_with?('{')
+
+    fields = JSON.parse(request)
+    parse_one(fields['name'].to_s, fields['config'].to_s)
+  rescue JSON::ParserError => e
+    { path: request, error: "invalid request: #{e.message}" }
+  end
+
+  # parses one config, from text if given, reporting errors instead of
+  # exiting; includes of text are resolved against the working directory
+  def parse_one(path, text = nil)
+    parsed = @options.watchdog.watch do
+      if text
+        ConfigParser.parse_string(text, path, Dir.pwd, @options.include_state)
+      else
+        ConfigParser.parse_config(path, @options.limits, @options.cache)
+      end
+    end
+    { path: path, config: Config::Directive.encode_json(ConfigParser.proto_config(parsed)) }
+  rescue Fluent::ConfigError, SystemCallError => e
+    { path: path, error: e.message }
+  end
+end
@@ -0,0 +1,142 @@
+# frozen_string_literal: true
+
+require 'fluent/config/error'
+require 'fluent/config/v1_parser'
+require 'uri'
+require_relative 'include_cache'
+
+# Raised when a config exceeds one of the parsing limits
+class ParseLimitError < Fluent::ConfigParseError
+end
+
+# Limits on @include expansion of a single top level config
+IncludeLimits = Struct.new(:max_depth, :max_bytes, :max_files) do
+  def self.default
+    new(32, 64 << 20, 1000)
+  end
+end
+
+# Tracks the files included while parsing one top level config
+class IncludeState
+  attr_reader :cache
+
+  def initialize(limits = IncludeLimits.default, cache = nil)
+    @limits = limits
+    @cache = cache
+    @stack = []
+    @nodes = []
+    @files = 0
+    @bytes = 0
+  end
+
+  # checks that including path is allowed, then enters it
+  def enter(path)
+    node = IncludeNode.read(path)
+    check(path, node.size)
+    @nodes.last&.children&.push(node)
+    @stack.push(path)
+    @nodes.push(node)
+    node
+  end
+
+  # leaves the innermost included file
+  def leave
+    @stack.pop
+    @nodes.pop
+  end
+
+  # accounts for the files of a cached fragment as if it was parsed again
+  def reuse(node)
+    @nodes.last&.children&.push(node)
+    account(node)
+  end
+
+  # checks a wildcard include does not add too many files at once
+  def check_glob(pattern, entries)
+    @nodes.last&.globs&.store(pattern, entries)
+    return if @files + entries.size <= @limits.max_files
+
+    raise ParseLimitError, "#{pattern} matches more than #{@limits.max_files} files"
+  end
+
+  private
+
+  def account(node)
+    check(node.path, node.size)
+    @stack.push(node.path)
+    node.children.each { |child| account(child) }
+    @stack.pop
+  end
+
+  def check(path, size)
+    raise ParseLimitError, "include cycle: #{(@stack + [path]).join(' -> ')}" if @stack.include?(path)
+    raise ParseLimitError, "includes nested deeper than #{@limits.max_depth}" if @stack.size > @limits.max_depth
+
+    @files += 1
+    @bytes += size
+    raise ParseLimitError, "more than #{@limits.max_files} included files" if @files > @limits.max_files
+    raise ParseLimitError, "includes expand to more than #{@limits.max_bytes} bytes" if @bytes > @limits.max_bytes
+  end
+end
+
+# V1 parser which expands file includes itself, so that include cycles and
+# includes exploding in depth, files or bytes fail with a clear error, and
+# fragments included by many configs are parsed once per run when cached
+class GuardedParser < Fluent::Config::V1Parser
+  def self.parse(data, fname, basepath, eval_context, state)
+    new(StringScanner.new(data), basepath, fname, eval_context, state).parse!
+  end
+
+  def initialize(strscan, include_basepath, fname, eval_context, state)
+    super(strscan, include_basepath, fname, eval_context)
+    @state = state
+  end
+
+  # same path handling as V1Parser#eval_include, urls are left to it
+  def eval_include(attrs, elems, uri)
+    u = URI.parse(uri.tr(' ', '+'))
+    return super unless file_uri?(u, uri)
+
+    path = URI.decode_www_form_component(u.path)
+    pattern = path.start_with?('/') ? path : File.expand_path("#{@include_basepath}/#{path}")
+    entries = Dir.glob(pattern).sort
+    @state.check_glob(pattern, entries)
+    entries.each { |entry| include_file(entry, attrs, elems) }
+  rescue SystemCallError => e
+    raise Fluent::ConfigParseError, "include error #{uri} - #{e}"
+  end
+
+  private
+
+  # windows absolute paths (e.g. C:) have a single letter scheme
+  def file_uri?(parsed, uri)
+    parsed.scheme == 'file' || parsed.scheme&.length == 1 || parsed.path == uri.tr(' ', '+')
+  end
+
+  # adds an included file to the current element
+  def include_file(entry, attrs, elems)
+    path = File.realpath(entry)
+    fragment = cached_fragment(path) || parse_fragment(entry, path)
+    attrs.merge!(fragment.attrs)
+    elems.concat(fragment.elems)
+  end
+
+  def cached_fragment(path)
+    fragment = @state.cache&.fetch(path)
+    @state.reuse(fragment.node) if fragment
+    fragment
+  end
+
+  def parse_fragment(entry, path)
+    fragment = IncludeFragment.new({}, [], @state.enter(path))
+    begin
+      data = File.read(entry).force_encoding('UTF-8')
+      GuardedParser.new(StringScanner.new(data), File.dirname(entry), File.basename(entry), @eval_context, @state)
+                   .parse_element(true, nil, fragment.attrs, fragment.elems)
+    ensure
+      @state.leave
+    end
+    @state.cache&.store(path, fragment)
+    fragment
+  end
+end
@@ -0,0 +1,65 @@
+# frozen_string_literal: true
+
+# A file read while parsing a config, with the files it included in turn
+IncludeNode = Struct.new(:path, :stamp, :globs, :children) do
+  def self.stamp(path)
+    stat = File.stat(path)
+    [stat.mtime, stat.size]
+  rescue SystemCallError
+    nil
+  end
+
+  def self.read(path)
+    new(path, stamp(path), {}, [])
+  end
+
+  def size
+    stamp ? stamp[1] : 0
+  end
+
+  # checks that this file, the wildcard includes it expanded and all the
+  # files it included are unchanged since they were parsed
+  def fresh?
+    stamp == IncludeNode.stamp(path) &&
+      globs.all? { |pattern, entries| Dir.glob(pattern).sort == entries } &&
+      children.all?(&:fresh?)
+  end
+end
+
+# Parsed include fragment: the attributes and elements it adds to the
+# element including it, and the tree of files it was parsed from
+IncludeFragment = Struct.new(:attrs, :elems, :node)
+
+# Bounded cache of parsed include fragments, shared by all the configs
+# parsed in one run. Fragments are keyed by resolved path, and are only
+# reused while the files they were parsed from keep their mtime and size.
+class IncludeCache
+  attr_reader :hits, :misses
+
+  def initialize(max_entries = 256)
+    @max_entries = max_entries
+    @entries = {}
+    @hits = 0
+    @misses = 0
+  end
+
+  # returns the fragment parsed from path, nil if missing or stale
+  def fetch(path)
+    fragment = @entries.delete(path)
+    if fragment&.node&.fresh?
+      @hits += 1
+      @entries[path] = fragment
+    else
+      @misses += 1
+      nil
+    end
+  end
+
+  # stores a fragment, evicting the least recently used beyond the limit
+  def store(path, fragment)
+    return if @max_entries <= 0
+
+    @entries[path] = fragment
+    @entries.shift while @entries.size > @max_entries
+  end
+end
@@ -0,0 +1,64 @@
+# frozen_string_literal: true
+
+require 'etc'
+require_relative 'guarded_parser'
+
+# Interrupts a parse that runs too long or grows the process too much
+class ParseWatchdog
+  INTERVAL = 0.05
+  PAGE_SIZE = Etc.sysconf(Etc::SC_PAGESIZE)
+
+  def initialize(timeout, max_memory_mb)
+    @timeout = timeout
+    @max_memory = max_memory_mb * 1024 * 1024
+    @lock = Mutex.new
+  end
+
+  # runs block, raising ParseLimitError in it if a limit is exceeded
+  def watch(&block)
+    @done = false
+    watcher = start(Thread.current)
+    block.call
+  ensure
+    @lock.synchronize { @done = true }
+    watcher&.kill
+  end
+
+  private
+
+  def start(parser)
+    deadline = now + @timeout
+    start_rss = rss
+    Thread.new do
+      loop do
+        sleep INTERVAL
+        message = check(deadline, start_rss)
+        next unless message
+
+        @lock.synchronize { parser.raise(ParseLimitError, message) unless @done }
+        break
+      end
+    end
+  end
+
+  # returns why the parse has to stop, nil if it may continue
+  def check(deadline, start_rss)
+    return "parsing took longer than #{@timeout}s" if now > deadline
+
+    current = rss
+    return unless start_rss && current && current - start_rss > @max_memory
+
+    "parsing used more than #{@max_memory / 1024 / 1024}MB"
+  end
+
+  def now
+    Process.clock_gettime(Process::CLOCK_MONOTONIC)
+  end
+
+  # resident set size in bytes, nil where /proc is not available
+  def rss
+    File.read('/proc/self/statm').split[1].to_i * PAGE_SIZE
+  rescue SystemCallError
+    nil
+  end
+end
@@ -0,0 +1,51 @@
+# frozen_string_literal: true
+
+require_relative 'guarded_parser'
+require_relative 'parse_watchdog'
+
+# Command line options of the parser: include expansion and resource limits,
+# the include cache and whether to serve
+class ParserOptions
+  attr_reader :limits, :cache
+
+  def initialize
+    @limits = IncludeLimits.default
+    @watchdog_limits = { timeout: 60, max_memory: 1024 }
+    @cache = IncludeCache.new
+    @serve = false
+  end
+
+  def serve?
+    @serve
+  end
+
+  # adds the options to an OptionParser
+  def define(input_parser)
+    input_parser.on('--serve', 'keep parsing configs named on stdin') { @serve = true }
+    input_parser.on('--include_cache_size N', Integer, 'included files to cache, default: 256') do |n|
+      @cache = IncludeCache.new(n)
+    end
+    define_limit_options(input_parser)
+  end
+
+  # watchdog enforcing the time and memory limits of one parse
+  def watchdog
+    ParseWatchdog.new(@watchdog_limits[:timeout], @watchdog_limits[:max_memory])
+  end
+
+  # include state for one top level config
+  def include_state
+    IncludeState.new(@limits, @cache)
+  end
+
+  private
+
+  # options limiting include expansion and resources used while parsing
+  def define_limit_options(input_parser)
+    input_parser.on('--max_include_depth N', Integer, 'default: 32') { |n| @limits.max_depth = n }
+    input_parser.on('--max_include_bytes N', Integer, 'default: 64MiB') { |n| @limits.max_bytes = n }
+    input_parser.on('--max_include_files N', Integer, 'default: 1000') { |n| @limits.max_files = n }
+    input_parser.on('--timeout SECONDS', Float, 'default: 60') { |n| @watchdog_limits[:timeout] = n }
+    input_parser.on('--max_memory MB', Integer, 'default: 1024') { |n| @watchdog_limits[:max_memory] = n }
+  end
+end
@@ -98,6 +98,13 @@ class TestConfigParser < Test::Unit::TestCase
     assert(ConfigParser.proto_config(ConfigParser.parse_config('test/data/emb_ruby.conf')) == expected)
   end
 
+  def test_string_parsed_like_file
+    path = 'test/data/multiple.conf'
+    expected = ConfigParser.proto_config(ConfigParser.parse_config(path))
+    parsed = ConfigParser.parse_string(File.read(path), 'multiple.conf', 'test/data')
+    assert(ConfigParser.proto_config(parsed) == expected)
+  end
+
   private
 
   # helper function to create object of message Param
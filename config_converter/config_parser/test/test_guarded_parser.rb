@@ -0,0 +1,55 @@
+# frozen_string_literal: true
+
+require 'test/unit'
+require 'config_parser'
+require 'json'
+
+# tests for include expansion limits, the include cache and the server
+class TestGuardedParser < Test::Unit::TestCase
+  def test_include_cycle_detected
+    error = assert_raise(ParseLimitError) { ConfigParser.parse_config('test/data/include_cycle_a.conf') }
+    assert_match(/include cycle: .*include_cycle_a.conf -> .*include_cycle_b.conf -> .*include_cycle_a.conf/,
+                 error.message)
+  end
+
+  def test_include_limits_enforced
+    path = 'test/data/include_nested.conf'
+    ConfigParser.parse_config(path, IncludeLimits.new(2, 1 << 20, 4))
+    {
+      IncludeLimits.new(1, 1 << 20, 10) => /includes nested deeper than 1/,
+      IncludeLimits.new(10, 100, 10) => /includes expand to more than 100 bytes/,
+      IncludeLimits.new(10, 1 << 20, 2) => /matches more than 2 files/
+    }.each do |limits, message|
+      error = assert_raise(ParseLimitError) { ConfigParser.parse_config(path, limits) }
+      assert_match(message, error.message)
+    end
+  end
+
+  def test_include_cache_reused
+    path = 'test/data/include_shared.conf'
+    expected = ConfigParser.proto_config(ConfigParser.parse_config(path))
+    cache = IncludeCache.new
+    2.times do
+      assert(ConfigParser.proto_config(ConfigParser.parse_config(path, IncludeLimits.default, cache)) == expected)
+    end
+    assert_equal([2, 2], [cache.hits, cache.misses])
+  end
+
+  def test_include_cache_limits_still_enforced
+    cache = IncludeCache.new
+    ConfigParser.parse_config('test/data/include_shared.conf', IncludeLimits.default, cache)
+    assert_raise(ParseLimitError) do
+      ConfigParser.parse_config('test/data/include_shared.conf', IncludeLimits.new(10, 1 << 20, 1), cache)
+    end
+  end
+
+  def test_server_answers_paths_and_text
+    path = 'test/data/comments.conf'
+    server = ConfigParserServer.new(ParserOptions.new)
+    by_path = server.answer(path)
+    by_text = server.answer(JSON.generate(name: 'bundle.tar:comments.conf', config: File.read(path)))
+    assert(by_text[:config] == by_path[:config])
+    assert(by_text[:path] == 'bundle.tar:comments.conf')
+    assert(server.answer('{"name":').key?(:error))
+  end
+end
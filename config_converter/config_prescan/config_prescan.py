@@ -0,0 +1,173 @@
+"""Cheap lexical pre-scan of fluentd configs, run before the full parser.
+
+The scan tokenizes a config line by line, following @include directives,
+and builds the same directive tree the parser would for the simple syntax
+it understands. If the config has nothing the mapper can convert (e.g. only
+<match> and <filter> blocks, or sources of unsupported plugins), the tree is
+enough to produce the output and its stats, and the parser is skipped.
+
+The scan is conservative: on anything it cannot tokenize with certainty,
+such as multi-line values, unbalanced sections, url includes or includes
+matching no file, it gives up and the config goes through the full parser.
+"""
+
+import glob
+import os
+import re
+from config_converter.config_archive import config_archive
+from config_converter.config_mapper import config_mapper
+from config_converter.config_mapper import config_pb2
+
+_SECTION_OPEN_RE = re.compile(r'^<([a-zA-Z0-9_]+)(?:\s+([^<>]*?))?\s*>$')
+_SECTION_CLOSE_RE = re.compile(r'^</([a-zA-Z0-9_]+)\s*>$')
+_QUOTED_RE = {
+    '"': re.compile(r'"((?:[^"\\]|\\.)*)"'),
+    "'": re.compile(r"'((?:[^'\\]|\\.)*)'")
+}
+
+
+class _GiveUp(Exception):
+    """Raised when the scan cannot tokenize a config with certainty."""
+
+
+class _Element:
+    """A section of a config, as the parser would build it."""
+
+    def __init__(self, name: str, args: str):
+        self.name = name
+        self.args = args
+        self.params = dict()  # later duplicates overwrite, like the parser
+        self.children = []
+
+    def to_directive(self, directive: config_pb2.Directive) -> None:
+        """Fills directive with this element and its children."""
+        directive.name = self.name
+        directive.args = self.args
+        for name, value in self.params.items():
+            directive.params.add(name=name, value=value)
+        for child in self.children:
+            child.to_directive(directive.directives.add())
+
+
+class _Scanner:
+    """Tokenizes config files into a tree of _Element."""
+
+    def __init__(self, max_depth: int, max_bytes: int, max_files: int):
+        self.limits = (max_depth, max_bytes, max_files)
+        self.stack = [_Element('ROOT', '')]
+        self.files = []
+        self.num_files = 0
+        self.num_bytes = 0
+
+    def scan_file(self, path: str) -> None:
+        """Tokenizes the file at path, streaming it line by line."""
+        path = os.path.realpath(path)
+        (max_depth, max_bytes, max_files) = self.limits
+        self.num_files += 1
+        self.num_bytes += os.path.getsize(path)
+        if (path in self.files or len(self.files) > max_depth or
+                self.num_files > max_files or self.num_bytes > max_bytes):
+            raise _GiveUp()  # the parser reports which limit was hit
+        self.files.append(path)
+        with open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                self.scan_line(line, os.path.dirname(path))
+        self.files.pop()
+
+    def scan_line(self, line: str, base_dir: str) -> None:
+        """Tokenizes one line, includes are resolved against base_dir."""
+        line = line.strip()
+        if not line or line.startswith('#'):
+            return
+        if line.split()[0] in {'@include', 'include'}:
+            target = config_archive.include_target(line)
+            if target is None or base_dir is None:
+                raise _GiveUp()
+            paths = sorted(glob.glob(os.path.join(base_dir, target)))
+            if not paths:
+                raise _GiveUp()  # the target may be misread, leave it to the parser
+            for path in paths:
+                self.scan_file(path)
+            return
+        close = _SECTION_CLOSE_RE.match(line)
+        if close:
+            if len(self.stack) < 2 or self.stack[-1].name != close.group(1):
+                raise _GiveUp()
+            self.stack.pop()
+            return
+        if line.startswith('<'):
+            section = _SECTION_OPEN_RE.match(line)
+            if not section:
+                raise _GiveUp()
+            element = _Element(section.group(1), section.group(2) or '')
+            self.stack[-1].children.append(element)
+            self.stack.append(element)
+            return
+        (name, value) = (line.split(None, 1) + [''])[:2]
+        self.stack[-1].params[name] = _scan_value(value)
+
+    def root(self) -> config_pb2.Directive:
+        """Returns the directive tree of everything scanned."""
+        if len(self.stack) != 1:
+            raise _GiveUp()
+        directive = config_pb2.Directive()
+        self.stack[0].to_directive(directive)
+        return directive
+
+
+def _scan_value(value: str) -> str:
+    """Returns a param value, giving up on values that may continue on the
+    next lines, or hold comments or embedded ruby."""
+    if value[:1] in _QUOTED_RE:
+        quoted = _QUOTED_RE[value[0]].fullmatch(value)
+        if not quoted or '#{' in value:
+            raise _GiveUp()
+        return re.sub(r'\\(.)', r'\1', quoted.group(1))
+    if '#' in value or (value[:1] in {'[', '{'} and
+                        (value.count('[') != value.count(']') or
+                         value.count('{') != value.count('}'))):
+        raise _GiveUp()
+    return value
+
+
+def _unsupported_only(scanner: _Scanner) -> config_pb2.Directive:
+    """Returns the scanned tree if it has nothing to map, else None."""
+    config_obj = scanner.root()
+    if config_mapper.needs_mapping(config_obj):
+        return None
+    return config_obj
+
+
+def prescan_file(path: str,
+                 max_depth: int = 32,
+                 max_bytes: int = 64 << 20,
+                 max_files: int = 1000) -> config_pb2.Directive:
+    """Pre-scans the config file at path, following its includes.
+
+    Returns:
+        The parsed directive tree if the config has no supported plugins,
+        so it can be mapped without the full parser; None if the config
+        needs the full conversion.
+    """
+    scanner = _Scanner(max_depth, max_bytes, max_files)
+    try:
+        scanner.scan_file(path)
+        return _unsupported_only(scanner)
+    except (_GiveUp, OSError, UnicodeDecodeError):
+        return None
+
+
+def prescan_text(text: str) -> config_pb2.Directive:
+    """Pre-scans config text whose includes were already expanded.
+
+    Returns:
+        Like prescan_file; any @include left in text needs the full
+        conversion.
+    """
+    scanner = _Scanner(0, 0, 0)
+    try:
+        for line in text.splitlines():
+            scanner.scan_line(line, None)
+        return _unsupported_only(scanner)
+    except _GiveUp:
+        return None
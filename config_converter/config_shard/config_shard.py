@@ -0,0 +1,166 @@
+"""Splits a manifest of fluentd configs into shards and merges shard results.
+
+Each config of a manifest belongs to exactly one of N shards, picked by a
+hash of its manifest entry, so every node computes the same partition
+without coordinating. A shard run (config_script --shard i/N) writes a
+shard result file, and this module merges those into one fleet report.
+
+Usage: To merge shard results:
+    python3 -m config_converter.config_shard.config_shard
+    <report path> <shard result path>...
+Where:
+    report path: where to write the merged fleet report json
+    shard result path: shard result files written by the shard runs
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import sys
+from config_converter.config_io import config_io
+
+
+class ShardError(Exception):
+    """Raised when shard results cannot be merged."""
+
+
+def parse_shard(value: str) -> tuple:
+    """Parses an 'index/count' shard spec into a tuple of ints."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'{value} is not of the form index/count')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'{value} needs 0 <= index < count')
+    return (index, count)
+
+
+def read_manifest(path: str) -> list:
+    """Returns config entries of a manifest, one path per line.
+
+    Blank lines and lines starting with # are ignored.
+    """
+    with open(path, 'rt') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def manifest_digest(entries: list) -> str:
+    """Returns a digest identifying the set of entries of a manifest."""
+    return hashlib.sha256('\n'.join(sorted(entries)).encode()).hexdigest()
+
+
+def shard_of(entry: str, count: int) -> int:
+    """Returns the shard a manifest entry belongs to.
+
+    Uses sha256 rather than hash(), which is salted per process.
+    """
+    digest = hashlib.sha256(entry.encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def select_shard(entries: list, index: int, count: int) -> list:
+    """Returns the entries belonging to shard index out of count."""
+    return [entry for entry in entries if shard_of(entry, count) == index]
+
+
+def resolve_entry(manifest_path: str, entry: str) -> str:
+    """Returns the config path of an entry, relative to the manifest."""
+    return os.path.join(os.path.dirname(manifest_path), entry)
+
+
+def output_name(entry: str) -> str:
+    """Returns the output name of an entry, keeping its directories so
+    configs from different hosts do not collide."""
+    name = posixpath.normpath(os.path.splitext(entry)[0]).lstrip('/')
+    if name == '..' or name.startswith('../'):
+        raise ValueError(f'{entry} points outside of the manifest directory')
+    return name
+
+
+def shard_result_path(master_dir: str, index: int, count: int) -> str:
+    """Returns where a shard run stores its shard result."""
+    return os.path.join(master_dir, f'shard-{index}-of-{count}.json')
+
+
+def write_json(path: str, result: dict) -> None:
+    """Writes result as json to path atomically."""
+    with config_io.atomic_write(path) as tmp_path:
+        with open(tmp_path, 'wt') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+def merge_results(results: list) -> dict:
+    """Merges shard results into a fleet report.
+
+    Stats counts of all converted configs are summed, failures are
+    collected, and shards missing from results are listed so an incomplete
+    merge is visible.
+
+    Raises:
+        ShardError: The results come from different manifests or shard
+          counts, or contain the same shard twice.
+    """
+    if not results:
+        raise ShardError('no shard results to merge')
+    count = results[0]['shards']
+    digest = results[0]['manifest_sha256']
+    merged = set()
+    report = {
+        'shards': count,
+        'manifest_sha256': digest,
+        'configs_num': 0,
+        'configs_converted': 0,
+        'configs_failed': 0,
+        'configs_changed': 0,
+        'stats': dict(),
+        'failures': dict(),
+        'configs': dict()
+    }
+    for result in results:
+        if result['shards'] != count or result['manifest_sha256'] != digest:
+            raise ShardError(
+                f'shard {result["shard"]} is from a different run')
+        if result['shard'] in merged:
+            raise ShardError(f'shard {result["shard"]} is merged twice')
+        merged.add(result['shard'])
+        for entry, config in result['configs'].items():
+            report['configs'][entry] = dict(config, shard=result['shard'])
+            report['configs_num'] += 1
+            if 'error' in config:
+                report['configs_failed'] += 1
+                report['failures'][entry] = config['error']
+                continue
+            report['configs_converted'] += 1
+            report['configs_changed'] += int(config['changed'])
+            for name, value in config['stats'].items():
+                if isinstance(value, int):
+                    report['stats'][name] = report['stats'].get(name,
+                                                                0) + value
+    report['shards_merged'] = sorted(merged)
+    report['shards_missing'] = sorted(set(range(count)) - merged)
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    shard_results = []
+    for result_path in sys.argv[2:]:
+        with open(result_path, 'rt') as f:
+            shard_results.append(json.load(f))
+    try:
+        fleet_report = merge_results(shard_results)
+    except ShardError as e:
+        sys.exit(f'error: {e}')
+    write_json(sys.argv[1], fleet_report)
+    print(
+        json.dumps(
+            {
+                name: fleet_report[name] for name in [
+                    'configs_num', 'configs_converted', 'configs_failed',
+                    'configs_changed', 'shards_missing'
+                ]
+            },
+            indent=2))
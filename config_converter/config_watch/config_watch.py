@@ -0,0 +1,271 @@
+"""Watches fluentd config files, and the files they include, for changes.
+
+Directories holding the watched files are monitored with inotify where the
+platform has it, and by periodically comparing directory snapshots
+otherwise. Watching directories rather than files also catches editors that
+save by writing a new file and renaming it over the old one.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import time
+from config_converter.config_archive import config_archive
+
+# inotify event masks, see inotify(7)
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_ONLYDIR = 0x1000000
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_WATCH_MASK = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF |
+               _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def include_closure(path: str) -> tuple:
+    """Finds the files a config depends on through @include.
+
+    Returns:
+        A tuple of the set of absolute paths of the config and every file
+        it includes (recursively), and the set of absolute glob patterns of
+        wildcard includes, which new files may start matching.
+    """
+    files = set()
+    patterns = set()
+    pending = [os.path.abspath(path)]
+    while pending:
+        current = pending.pop()
+        if current in files:
+            continue
+        files.add(current)
+        try:
+            with open(current, 'rt') as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError):
+            continue
+        for line in lines:
+            target = config_archive.include_target(line)
+            if target is None:
+                continue
+            pattern = os.path.normpath(
+                os.path.join(os.path.dirname(current), target))
+            if glob.has_magic(pattern):
+                patterns.add(pattern)
+                pending.extend(glob.glob(pattern))
+            else:
+                pending.append(pattern)
+    return (files, patterns)
+
+
+def _parent_dirs(files: set, patterns: set) -> set:
+    """Returns the directories holding files and the files matching
+    patterns."""
+    dirs = {os.path.dirname(path) for path in files}
+    for pattern in patterns:
+        directory = os.path.dirname(pattern)
+        while glob.has_magic(directory):
+            directory = os.path.dirname(directory)
+        dirs.add(directory)
+    return dirs
+
+
+def watched_dirs(files: set, patterns: set) -> set:
+    """Returns directories to watch for changes to files and patterns.
+
+    A directory that does not exist (e.g. deleted to be deployed again) is
+    replaced by its nearest existing parent, where it will be created.
+    """
+    dirs = set()
+    for directory in _parent_dirs(files, patterns):
+        while (not os.path.isdir(directory) and
+               directory != os.path.dirname(directory)):
+            directory = os.path.dirname(directory)
+        dirs.add(directory)
+    return dirs
+
+
+def affected(changed: set, files: set, patterns: set) -> bool:
+    """Checks whether any changed path is one of files, matches one of
+    patterns, or is a directory holding them."""
+    return bool(changed & (files | _parent_dirs(files, patterns))) or any(
+        fnmatch.fnmatchcase(path, pattern)
+        for path in changed
+        for pattern in patterns)
+
+
+class InotifyWatcher:
+    """Reports changed paths in watched directories using inotify."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = dict()
+
+    def set_dirs(self, dirs: set) -> None:
+        """Watches exactly dirs, adding and removing watches as needed."""
+        for directory, wd in list(self._dirs.items()):
+            if directory not in dirs:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._dirs[directory]
+        for directory in dirs - set(self._dirs):
+            wd = self._libc.inotify_add_watch(self._fd, directory.encode(),
+                                              _WATCH_MASK)
+            if wd >= 0:
+                self._dirs[directory] = wd
+
+    def read(self, timeout: float = None) -> set:
+        """Waits up to timeout seconds (forever if None) for events.
+
+        Returns:
+            The set of changed paths, empty if nothing changed in time.
+            If the kernel queue overflowed, every watched directory is
+            reported as changed. A watched directory that was deleted or
+            moved is reported as changed and no longer watched, so that
+            set_dirs watches it again once it is back.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        names = {wd: directory for directory, wd in self._dirs.items()}
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    changed.update(self._dirs)
+                elif wd not in names:
+                    continue
+                elif mask & (_IN_IGNORED | _IN_DELETE_SELF | _IN_MOVE_SELF):
+                    if mask & _IN_MOVE_SELF:
+                        # the watch follows the moved directory, drop it
+                        self._libc.inotify_rm_watch(self._fd, wd)
+                    directory = names.pop(wd)
+                    del self._dirs[directory]
+                    changed.add(directory)
+                else:
+                    changed.add(os.path.join(names[wd], name))
+
+    def close(self) -> None:
+        """Stops watching."""
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Reports changed paths in watched directories by comparing periodic
+    snapshots of their entries."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._snapshots = dict()
+
+    @staticmethod
+    def _snapshot(directory: str) -> dict:
+        """Returns name to (mtime, size, inode) of entries of directory."""
+        entries = dict()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        info = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries[entry.name] = (info.st_mtime_ns, info.st_size,
+                                           info.st_ino)
+        except OSError:
+            pass
+        return entries
+
+    def set_dirs(self, dirs: set) -> None:
+        """Watches exactly dirs."""
+        self._snapshots = {
+            directory: self._snapshots[directory]
+            if directory in self._snapshots else self._snapshot(directory)
+            for directory in dirs
+        }
+
+    def read(self, timeout: float = None) -> set:
+        """Polls until something changed or timeout seconds passed.
+
+        Returns:
+            The set of changed paths, empty if nothing changed in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(
+                self.interval, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            changed = set()
+            for directory, before in self._snapshots.items():
+                after = self._snapshot(directory)
+                if after != before:
+                    self._snapshots[directory] = after
+                    changed.update(
+                        os.path.join(directory, name)
+                        for name in set(before) | set(after)
+                        if before.get(name) != after.get(name))
+            if changed or (deadline is not None and
+                           time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        """Stops watching."""
+        self._snapshots = dict()
+
+
+def create_watcher(poll_interval: float, use_inotify: bool = True):
+    """Returns an InotifyWatcher if available, else a PollingWatcher."""
+    if use_inotify:
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(poll_interval)
+
+
+def wait_for_changes(watcher, debounce: float, max_delay: float) -> tuple:
+    """Blocks until paths change, then coalesces the burst of changes.
+
+    After the first change, changes keep being collected until none arrive
+    for debounce seconds, or max_delay seconds passed since the first one,
+    so a save touching several files is handled as one change.
+
+    Returns:
+        A tuple of the set of all changed paths of the burst, and the
+        time.monotonic() at which the first change was seen.
+    """
+    changed = set()
+    while not changed:
+        changed = watcher.read(None)
+    first_seen = time.monotonic()
+    deadline = first_seen + max_delay
+    while True:
+        remaining = min(debounce, deadline - time.monotonic())
+        if remaining <= 0:
+            return (changed, first_seen)
+        more = watcher.read(remaining)
+        if not more:
+            return (changed, first_seen)
+        changed |= more
@@ -4,16 +4,183 @@ Program that converts a fluentd config file to a master agent config file.
 Usage:
     python3 -m config_script [--help] [--log_level] [--log_filepath]
     [--master_agent_log_level level] [--master_agent_log_dirpath path]
+    [--check] [--archive_members pattern] [--max_archive_bytes n]
+    [--max_include_depth n] [--max_include_bytes n] [--max_include_files n]
+    [--parse_timeout seconds] [--parse_max_memory MB] [--include_cache_size n]
+    [--shard index/count]
+    [--watch] [--watch_debounce seconds] [--watch_poll_interval seconds]
+    [--no_prescan] [--checkpoint_dir path] [--overwrite_checkpoints]
+    [--corpus] [--corpus_workers n]
     <fluentd path> <master path>
 Where:
-    master path: directory to store master agent config file in
-    fluentd path: path to the fluentd config file
+    master path: directory to store master agent config file in, or an
+    archive (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, .zip) to store it in
+    fluentd path: path to the fluentd config file, or an archive of fluentd
+    config files; every member matching --archive_members is converted.
+    Compressed tar archives are held in memory while converting, up to
+    --max_archive_bytes
+    --shard: the fluentd path is a manifest with one config path per line;
+    only the configs hashed into this shard are converted, and a shard
+    result file is written next to the outputs (not with --check); the
+    master path must be a directory. Merge shard results with
+    python3 -m config_converter.config_shard.config_shard
+    --watch: keep running, reconverting the config (or the configs of the
+    shard) whenever it or a file it includes changes
+    --check: report whether the master agent config file would change,
+    without writing it
+    include and parse limits: a config whose includes cycle or exceed them,
+    or whose parsing takes too long or too much memory, fails with an error
+    --no_prescan: always run the parser, even on configs the pre-scan finds
+    have nothing to convert
+    --checkpoint_dir: migrate the fluentd pos file of every converted source
+    to a master agent checkpoint in this directory, so tailing resumes where
+    fluentd stopped; existing checkpoints are kept unless
+    --overwrite_checkpoints is given, and with --check nothing is written
+    --corpus: the fluentd path is a directory of golden fixtures (<name>.conf
+    next to the expected <name>.yaml, and optionally <name>.stats.json);
+    every fixture is converted in parallel and compared with its expected
+    output, and outputs that differ are written to the master path
 """
 
 import argparse
+import concurrent.futures
+import hashlib
+import json
 import os
+import select
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from config_converter.config_archive import config_archive
+from config_converter.config_checkpoint import config_checkpoint
+from config_converter.config_corpus import config_corpus
+from config_converter.config_mapper import config_mapper
+from config_converter.config_prescan import config_prescan
+from config_converter.config_shard import config_shard
+from config_converter.config_watch import config_watch
+
+_PARSER = 'config_converter/config_parser/bin/config_parser'
+# seconds past the parse timeout before the parser process is killed
+_PARSE_KILL_GRACE = 5
+# longest seconds a burst of changes is coalesced before reconverting
+_WATCH_MAX_DELAY = 0.5
+
+
+class ConversionError(Exception):
+    """Raised when a single fluentd config could not be converted."""
+
+
+class OutputSink:
+    """Writes (or checks) master agent config files.
+
+    Outputs go to a directory, or are collected and written to an archive
+    once all configs have been converted. Either way only changed outputs
+    count as changes, and with check set nothing is written. Like the other
+    files of a directory, members of an existing archive that are not
+    converted again are kept.
+    """
+
+    def __init__(self, master_dir: str, check: bool):
+        self.master_dir = master_dir
+        self.check = check
+        self.is_archive = config_archive.is_archive(master_dir)
+        self.existing = dict()
+        self.changed = False
+        if self.is_archive and os.path.isfile(master_dir):
+            with config_archive.read_members(master_dir) as existing:
+                self.existing = dict(existing)
+        self.members = dict(self.existing)
+
+    def put(self, name: str, yaml_dict: dict) -> bool:
+        """Stores the output for name, returns whether it changed."""
+        diff = []
+        if self.is_archive:
+            content = config_mapper.dump_yaml(yaml_dict).encode()
+            self.members[f'{name}.yaml'] = content
+            changed = self.existing.get(f'{name}.yaml') != content
+            target = f'{self.master_dir}:{name}.yaml'
+        elif self.check:
+            diff = config_mapper.diff_yaml(yaml_dict, self.master_dir, name)
+            changed = bool(diff)
+            target = os.path.join(self.master_dir, f'{name}.yaml')
+        else:
+            changed = config_mapper.write_to_yaml(yaml_dict, self.master_dir,
+                                                  name)
+        if self.check:
+            print(f'{"would change" if changed else "unchanged"}: {target}')
+            sys.stdout.writelines(diff)
+        self.changed = self.changed or changed
+        return changed
+
+    def close(self) -> bool:
+        """Writes the output archive if needed, returns whether anything
+        changed since the last close."""
+        changed = self.changed
+        if self.is_archive and not self.check and changed:
+            config_archive.write_archive(self.master_dir, self.members)
+            self.existing = dict(self.members)
+        self.changed = False
+        return changed
+
+
+class WarmParser:
+    """Keeps one parser process running to parse config after config.
+
+    This spares the ruby and fluentd startup for every config. The process
+    is restarted if it dies, and killed if it does not answer within a few
+    seconds past the parse timeout.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self._process = None
+
+    def parse(self, config_path: str, config_text: str = None) -> str:
+        """Returns the parsed config json string of the file config_path.
+
+        If config_text is given it is sent to the parser instead of reading
+        config_path, which is then only used in error messages.
+
+        Raises:
+            ConversionError: The parser failed on the config.
+        """
+        if config_text is not None:
+            request = json.dumps({'name': config_path, 'config': config_text})
+        elif '\n' in config_path:
+            raise ConversionError(f'invalid config path {config_path!r}')
+        else:
+            request = os.path.abspath(config_path)
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                [_PARSER, '--serve'] + parser_options(self.args),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True)
+        self._process.stdin.write(request + '\n')
+        self._process.stdin.flush()
+        if not select.select([self._process.stdout], [], [],
+                             self.args.parse_timeout + _PARSE_KILL_GRACE)[0]:
+            self.close()
+            raise ConversionError(
+                f'parsing {config_path} took longer than '
+                f'{self.args.parse_timeout}s and was killed')
+        line = self._process.stdout.readline()
+        if not line:
+            self.close()
+            raise ConversionError(f'failed to parse {config_path}')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ConversionError(f'{config_path}: {response["error"]}')
+        return response['config']
+
+    def close(self) -> None:
+        """Stops the parser process."""
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
 
 
 def read_file(path: str) -> str:
@@ -22,38 +189,410 @@ def read_file(path: str) -> str:
         return f.read()
 
 
-def get_object(args: list) -> None:
-    """Run ruby exec file and get message object."""
+def parser_options(args: argparse.Namespace) -> list:
+    """Returns the include and watchdog limit options for the parser."""
+    return [
+        f'--max_include_depth={args.max_include_depth}',
+        f'--max_include_bytes={args.max_include_bytes}',
+        f'--max_include_files={args.max_include_files}',
+        f'--timeout={args.parse_timeout}',
+        f'--max_memory={args.parse_max_memory}',
+        f'--include_cache_size={args.include_cache_size}'
+    ]
+
+
+def get_object(args: argparse.Namespace, config_path: str) -> str:
+    """Run ruby exec file and get parsed config json string.
+
+    The parser stops itself when a config exceeds the include or watchdog
+    limits; in case it cannot, it is killed a few seconds after the parse
+    timeout.
+
+    Raises:
+        ConversionError: The parser failed on the config.
+    """
+    with tempfile.TemporaryDirectory() as json_dir:
+        try:
+            subprocess.run([_PARSER] + parser_options(args) +
+                           [config_path, json_dir],
+                           timeout=args.parse_timeout + _PARSE_KILL_GRACE,
+                           check=True)
+        except subprocess.CalledProcessError:
+            raise ConversionError(f'failed to parse {config_path}')
+        except subprocess.TimeoutExpired:
+            raise ConversionError(
+                f'parsing {config_path} took longer than '
+                f'{args.parse_timeout}s and was killed')
+        if not os.path.exists(json_dir + '/config.json'):
+            raise ConversionError(f'failed to parse {config_path}')
+        return read_file(f'{json_dir}/config.json')
+
+
+def map_object(args: argparse.Namespace, config_json: str) -> tuple:
+    """Map parsed config json to master agent config dict and stats.
+
+    Raises:
+        ConversionError: The config is invalid, the mapper logged why.
+    """
+    try:
+        return config_mapper.convert_config(config_json,
+                                            args.master_agent_log_level,
+                                            args.master_agent_log_dirpath)
+    except SystemExit:
+        raise ConversionError('invalid configuration, see log file')
+
+
+def prescan_object(args: argparse.Namespace,
+                   config_path: str,
+                   config_text: str = None) -> tuple:
+    """Map a config without the parser if it has nothing to convert.
+
+    If config_text is given it is scanned instead of reading config_path,
+    and must have its includes already expanded.
+
+    Returns:
+        A tuple of master agent config dict and stats like map_object, or
+        None if the config needs the full parser.
+    """
+    if args.no_prescan:
+        return None
+    if config_text is None:
+        config_obj = config_prescan.prescan_file(config_path,
+                                                 args.max_include_depth,
+                                                 args.max_include_bytes,
+                                                 args.max_include_files)
+    else:
+        config_obj = config_prescan.prescan_text(config_text)
+    if config_obj is None:
+        return None
+    return config_mapper.convert_directive(config_obj,
+                                           args.master_agent_log_level,
+                                           args.master_agent_log_dirpath)
+
+
+def load_object(args: argparse.Namespace,
+                config_path: str,
+                config_text: str = None,
+                parser: WarmParser = None) -> tuple:
+    """Convert a config to master agent config dict and stats.
+
+    The config is pre-scanned first, and only parsed when it has something
+    to convert: by parser if given, else by a new parser process. Text of a
+    config not on disk (config_text) can only be parsed by a parser. With
+    --checkpoint_dir the pos files of its sources are then migrated (only
+    reported with --check).
+
+    Raises:
+        ConversionError: The config could not be parsed or mapped.
+    """
+    mapped = prescan_object(args, config_path, config_text)
+    if mapped is None and parser is not None:
+        mapped = map_object(args, parser.parse(config_path, config_text))
+    elif mapped is None:
+        mapped = map_object(args, get_object(args, config_path))
+    if args.checkpoint_dir:
+        (yaml_dict, stats) = mapped
+        config_checkpoint.migrate_sources(yaml_dict,
+                                          args.checkpoint_dir,
+                                          stats,
+                                          overwrite=args.overwrite_checkpoints,
+                                          write=not args.check)
+    return mapped
+
+
+def convert_object(args: argparse.Namespace,
+                   sink: OutputSink,
+                   file_name: str,
+                   config_path: str,
+                   config_text: str = None,
+                   parser: WarmParser = None) -> dict:
+    """Convert a config and store the yaml file in sink.
+
+    Returns:
+        The stats dict of the conversion.
+    """
+    (yaml_dict, stats) = load_object(args, config_path, config_text, parser)
+    sink.put(file_name, yaml_dict)
+    return stats
+
+
+def convert_archive(args: argparse.Namespace, sink: OutputSink) -> dict:
+    """Convert every matching config of an input archive.
+
+    Members are read from the archive as needed (see config_archive) and
+    sent to one warm parser with their includes already expanded, so
+    nothing is extracted to disk. Being expanded, they do not use the
+    parser's include cache. A config that fails to convert is
+    reported and does not stop the rest.
+
+    Returns:
+        A dict mapping output names to stats dicts, or to an error message.
+
+    Raises:
+        ArchiveError: The archive cannot be read within
+          --max_archive_bytes.
+    """
+    results = dict()
+    parser = WarmParser(args)
+    with config_archive.read_members(args.config_path,
+                                     args.max_archive_bytes) as members:
+        for member in config_archive.config_names(members,
+                                                  args.archive_members):
+            name = os.path.splitext(member)[0]
+            try:
+                config_text = config_archive.expand_includes(
+                    members, member, args.max_include_depth,
+                    args.max_include_bytes, args.max_include_files)
+                results[name] = convert_object(
+                    args, sink, name, f'{args.config_path}:{member}',
+                    config_text, parser)
+            except (ConversionError, config_archive.IncludeError,
+                    UnicodeDecodeError) as e:
+                results[name] = {'error': str(e)}
+    parser.close()
+    return results
+
+
+def convert_shard(args: argparse.Namespace, sink: OutputSink) -> dict:
+    """Convert the configs of a manifest that belong to this shard.
+
+    All configs go through one warm parser, so fragments they include in
+    common are parsed once. A config that fails to convert is recorded in
+    the result and does not stop the rest.
+
+    Returns:
+        The shard result: per config stats (or error), whether its output
+        changed and the sha256 of the output.
+    """
+    (index, count) = args.shard
+    start = time.monotonic()
+    entries = config_shard.read_manifest(args.config_path)
+    configs = dict()
+    parser = WarmParser(args)
+    for entry in config_shard.select_shard(entries, index, count):
+        try:
+            name = config_shard.output_name(entry)
+            (yaml_dict, stats) = load_object(
+                args,
+                config_shard.resolve_entry(args.config_path, entry),
+                parser=parser)
+        except (ConversionError, ValueError) as e:
+            configs[entry] = {'error': str(e)}
+            continue
+        configs[entry] = {
+            'output': f'{name}.yaml',
+            'stats': stats,
+            'changed': sink.put(name, yaml_dict),
+            'sha256': hashlib.sha256(
+                config_mapper.dump_yaml(yaml_dict).encode()).hexdigest()
+        }
+    parser.close()
+    return {
+        'manifest': args.config_path,
+        'manifest_sha256': config_shard.manifest_digest(entries),
+        'shard': index,
+        'shards': count,
+        'elapsed_seconds': round(time.monotonic() - start, 3),
+        'configs': configs
+    }
+
+
+def run_corpus(args: argparse.Namespace, sink: OutputSink) -> bool:
+    """Convert every fixture of a corpus and compare it with its golden
+    output.
+
+    Fixtures are converted in --corpus_workers threads, each with its own
+    warm parser, and reported in name order with their conversion time and
+    the key paths at which they differ. A fixture that cannot be converted
+    or read fails with its error, without stopping the rest. The outputs of
+    failed fixtures are stored in sink.
+
+    Returns:
+        Whether every fixture matched.
+    """
+    local = threading.local()
+    parsers = []
+    lock = threading.Lock()
+
+    def convert(fixture: config_corpus.Fixture) -> tuple:
+        if not hasattr(local, 'parser'):
+            local.parser = WarmParser(args)
+            with lock:
+                parsers.append(local.parser)
+        start = time.monotonic()
+        yaml_dict = None
+        try:
+            (yaml_dict, stats) = load_object(args,
+                                             fixture.config_path,
+                                             parser=local.parser)
+            elapsed = time.monotonic() - start
+            return (yaml_dict,
+                    config_corpus.check_fixture(fixture, yaml_dict,
+                                                stats), elapsed)
+        except (ConversionError, config_corpus.FixtureError, OSError) as e:
+            return (yaml_dict, [str(e)], time.monotonic() - start)
+
+    start = time.monotonic()
+    fixtures = config_corpus.find_fixtures(args.config_path)
+    failed = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+                args.corpus_workers) as pool:
+            for (fixture, (yaml_dict, diffs, elapsed)) in zip(
+                    fixtures, pool.map(convert, fixtures)):
+                status = 'ok' if not diffs else 'FAIL'
+                print(f'{status} {fixture.name} {elapsed * 1000:.1f}ms')
+                for diff in diffs:
+                    print(f'    {diff}')
+                if diffs:
+                    failed += 1
+                    if yaml_dict is not None:
+                        sink.put(fixture.name, yaml_dict)
+    finally:
+        for parser in parsers:
+            parser.close()
+    print(f'{len(fixtures) - failed} of {len(fixtures)} fixtures passed in '
+          f'{time.monotonic() - start:.1f}s')
+    return not failed
+
+
+def watch_convert(args: argparse.Namespace, sink: OutputSink,
+                  parser: WarmParser, name: str, config_path: str) -> dict:
+    """Convert one watched config, returns a report of it including the
+    conversion time."""
+    start = time.monotonic()
+    report = {'config': config_path, 'output': f'{name}.yaml'}
+    try:
+        (yaml_dict, report['stats']) = load_object(args,
+                                                   config_path,
+                                                   parser=parser)
+        report['changed'] = sink.put(name, yaml_dict)
+    except ConversionError as e:
+        report['error'] = str(e)
+    report['convert_ms'] = round((time.monotonic() - start) * 1000, 1)
+    return report
+
+
+def watch_batch(args: argparse.Namespace,
+                sink: OutputSink,
+                parser: WarmParser,
+                configs: dict,
+                names,
+                first_seen: float = None) -> None:
+    """Convert the watched configs names, and print a line reporting each
+    once their outputs are written.
+
+    An output archive is written once for the whole batch. With first_seen
+    (the time.monotonic() the change was first seen) the reports include
+    the latency of the whole reconversion.
+    """
+    reports = [
+        watch_convert(args, sink, parser, name, configs[name])
+        for name in names
+    ]
+    sink.close()
+    for report in reports:
+        if first_seen is not None:
+            report['latency_ms'] = round(
+                (time.monotonic() - first_seen) * 1000, 1)
+        print(json.dumps(report), flush=True)
+
+
+def watch_depends(watcher, depends: dict, configs: dict, names) -> None:
+    """Update the include closures of configs names in depends, and watch
+    the directories of all the configs of depends.
+
+    This is done before the configs are converted, so that a change made
+    while they are converted is not missed.
+    """
+    for name in names:
+        depends[name] = config_watch.include_closure(configs[name])
+    watcher.set_dirs(set().union(*(config_watch.watched_dirs(*depend)
+                                   for depend in depends.values())))
+
+
+def watch_configs(args: argparse.Namespace, sink: OutputSink,
+                  configs: dict) -> None:
+    """Convert configs, then reconvert them whenever they change.
+
+    Changes to a config or any file it includes are debounced, and only the
+    configs affected by a burst of changes are reconverted, reusing the
+    same warm parser. Each reconversion reports its latency from the first
+    change of the burst. Runs until interrupted.
+
+    Args:
+        args: the parsed command line arguments.
+        sink: where to write outputs.
+        configs: a dict mapping output names to config paths.
+    """
+    parser = WarmParser(args)
+    watcher = config_watch.create_watcher(args.watch_poll_interval)
+    depends = dict()
     try:
-        subprocess.run(['config_converter/config_parser/bin/config_parser'] +
-                       args,
-                       check=True)
-    except subprocess.CalledProcessError:
-        sys.exit()
-    if not os.path.exists(args[-1] + '/config.json'):
-        sys.exit()
-
-
-def convert_object(args: list) -> None:
-    """Run config_mapper python file to create yaml file."""
-    config_json: str = read_file(f'{args[0]}/config.json')
-    cli_args = args + [config_json]
+        watch_depends(watcher, depends, configs, configs)
+        watch_batch(args, sink, parser, configs, configs)
+        while True:
+            (changed, first_seen) = config_watch.wait_for_changes(
+                watcher, args.watch_debounce, _WATCH_MAX_DELAY)
+            names = [
+                name for name, depend in depends.items()
+                if config_watch.affected(changed, *depend)
+            ]
+            watch_depends(watcher, depends, configs, names)
+            watch_batch(args, sink, parser, configs, names, first_seen)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        parser.close()
+        watcher.close()
+
+
+def watch_targets(args: argparse.Namespace) -> dict:
+    """Returns output names mapped to the config paths to watch."""
+    if not args.shard:
+        return {
+            os.path.splitext(os.path.basename(args.config_path))[0]:
+            args.config_path
+        }
+    entries = config_shard.select_shard(
+        config_shard.read_manifest(args.config_path), *args.shard)
+    return {
+        config_shard.output_name(entry):
+        config_shard.resolve_entry(args.config_path, entry)
+        for entry in entries
+    }
+
+
+def shard_spec(value: str) -> tuple:
+    """Argument type for --shard."""
     try:
-        subprocess.run([
-            'python3', '-B', '-m',
-            'config_converter.config_mapper.config_mapper'
-        ] + cli_args,
-                       check=True)
-    except subprocess.CalledProcessError:
-        sys.exit()
+        return config_shard.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def validate_args(parser: argparse.ArgumentParser,
                   args: argparse.Namespace) -> None:
     """Validate paths of config file and master dir."""
-    if not os.path.isfile(args.config_path):
+    if args.corpus_workers < 1:
+        parser.print_usage()
+        print(f'{parser.prog}: error: --corpus_workers must be at least 1')
+    elif args.corpus and not os.path.isdir(args.config_path):
+        parser.print_usage()
+        print(f'{parser.prog}: error: {args.config_path} is invalid corpus '
+              'directory')
+    elif not args.corpus and not os.path.isfile(args.config_path):
         parser.print_usage()
         print(f'{parser.prog}: error: {args.config_path} is invalid file')
+    elif args.shard and config_archive.is_archive(args.master_dir):
+        parser.print_usage()
+        print(f'{parser.prog}: error: --shard needs an output directory, '
+              'shards cannot share an archive')
+    elif config_archive.is_archive(args.master_dir):
+        if os.path.isdir(os.path.dirname(args.master_dir) or '.'):
+            return
+        parser.print_usage()
+        print(f'{parser.prog}: error: {args.master_dir} is invalid archive')
     elif not os.path.isdir(args.master_dir):
         parser.print_usage()
         print(f'{parser.prog}: error: {args.master_dir} is invalid directory')
@@ -66,9 +605,10 @@ def create_parser() -> argparse.ArgumentParser:
     """Create a parser and optional arguments."""
     parser = argparse.ArgumentParser(description='Configuration Converter',
                                      prog='PROG')
-    parser.add_argument('config_path', help='path of fluentd config file')
-    parser.add_argument('master_dir',
-                        help='directory to store master config file in')
+    parser.add_argument('config_path',
+                        help='path of fluentd config file or archive')
+    parser.add_argument(
+        'master_dir', help='directory or archive to store master config in')
     parser.add_argument(
         '--master_agent_log_level',
         default='info',
@@ -90,6 +630,111 @@ def create_parser() -> argparse.ArgumentParser:
         metavar='path',
         default='/tmp/log/config_migration/config_migration.log',
         help='default: /tmp/log/config_migration/config_migration.log')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='report whether the master config file would change and '
+        'exit with status 1 if so, without writing it')
+    parser.add_argument(
+        '--archive_members',
+        metavar='pattern',
+        default='**/*.conf',
+        help='members of an input archive to convert, default: **/*.conf')
+    parser.add_argument(
+        '--max_archive_bytes',
+        metavar='n',
+        type=int,
+        default=1 << 30,
+        help='most bytes of members read into memory from a compressed tar '
+        'archive, default: 1GiB')
+    parser.add_argument('--max_include_depth',
+                        metavar='n',
+                        type=int,
+                        default=32,
+                        help='deepest @include nesting allowed, default: 32')
+    parser.add_argument(
+        '--max_include_bytes',
+        metavar='n',
+        type=int,
+        default=64 << 20,
+        help='most bytes a config may expand to with its includes, '
+        'default: 64MiB')
+    parser.add_argument(
+        '--max_include_files',
+        metavar='n',
+        type=int,
+        default=1000,
+        help='most files a config may include, default: 1000')
+    parser.add_argument(
+        '--parse_timeout',
+        metavar='seconds',
+        type=float,
+        default=60,
+        help='longest time parsing a single config may take, default: 60')
+    parser.add_argument(
+        '--parse_max_memory',
+        metavar='MB',
+        type=int,
+        default=1024,
+        help='most memory parsing a single config may use, default: 1024')
+    parser.add_argument(
+        '--include_cache_size',
+        metavar='n',
+        type=int,
+        default=256,
+        help='included files whose parse is kept for other configs of the '
+        'same run, default: 256')
+    parser.add_argument(
+        '--shard',
+        metavar='index/count',
+        type=shard_spec,
+        help='treat the fluentd path as a manifest listing config files, '
+        'and convert only those in shard index out of count')
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='keep running, and reconvert configs whenever they or files '
+        'they include change')
+    parser.add_argument(
+        '--watch_debounce',
+        metavar='seconds',
+        type=float,
+        default=0.1,
+        help='quiet time that ends a burst of changes, default: 0.1')
+    parser.add_argument(
+        '--watch_poll_interval',
+        metavar='seconds',
+        type=float,
+        default=0.5,
+        help='how often to poll for changes where inotify is not '
+        'available, default: 0.5')
+    parser.add_argument(
+        '--no_prescan',
+        action='store_true',
+        help='parse every config, even those a quick scan finds have '
+        'nothing to convert')
+    parser.add_argument(
+        '--checkpoint_dir',
+        metavar='path',
+        help='migrate the fluentd pos files of converted sources to master '
+        'agent checkpoints in this directory, keeping checkpoints already '
+        'there')
+    parser.add_argument(
+        '--overwrite_checkpoints',
+        action='store_true',
+        help='replace checkpoints already in --checkpoint_dir with the '
+        'fluentd offsets')
+    parser.add_argument(
+        '--corpus',
+        action='store_true',
+        help='treat the fluentd path as a directory of .conf/.yaml golden '
+        'fixtures, and check that each converts to its .yaml')
+    parser.add_argument(
+        '--corpus_workers',
+        metavar='n',
+        type=int,
+        default=os.cpu_count(),
+        help='fixtures converted in parallel, default: number of cpus')
     return parser
 
 
@@ -97,11 +742,39 @@ if __name__ == '__main__':
     parser: argparse.ArgumentParser = create_parser()
     args: argparse.Namespace = parser.parse_args()
     validate_args(parser, args)
-    file_name: str = os.path.splitext(os.path.basename(args.config_path))[0]
-    get_object([args.config_path, args.master_dir])
-    convert_object([
-        args.master_dir, file_name, args.log_level, args.log_filepath,
-        args.master_agent_log_level, args.master_agent_log_dirpath
-    ])
-    subprocess.run(['rm', os.path.join(args.master_dir, 'config.json')],
-                   check=True)
+    config_mapper.initialize_logger(args.log_level, args.log_filepath)
+    sink = OutputSink(args.master_dir, args.check)
+    if args.corpus:
+        corpus_passed: bool = run_corpus(args, sink)
+        sink.close()
+        sys.exit(0 if corpus_passed else 1)
+    elif args.watch:
+        if config_archive.is_archive(args.config_path):
+            parser.error('--watch cannot watch an archive')
+        watch_configs(args, sink, watch_targets(args))
+    elif args.shard:
+        shard_result: dict = convert_shard(args, sink)
+        if not args.check:
+            config_shard.write_json(
+                config_shard.shard_result_path(args.master_dir, *args.shard),
+                shard_result)
+        print(json.dumps(shard_result, indent=2))
+    elif config_archive.is_archive(args.config_path):
+        try:
+            print(json.dumps(convert_archive(args, sink), indent=2))
+        except config_archive.ArchiveError as e:
+            print(f'{parser.prog}: error: {e}', file=sys.stderr)
+            sys.exit()
+    else:
+        file_name: str = os.path.splitext(os.path.basename(
+            args.config_path))[0]
+        try:
+            print(
+                json.dumps(convert_object(args, sink, file_name,
+                                          args.config_path),
+                           indent=2))
+        except ConversionError as e:
+            print(f'{parser.prog}: error: {e}', file=sys.stderr)
+            sys.exit()
+    if sink.close() and args.check:
+        sys.exit(1)
@@ -5,9 +5,27 @@ Usage: python3 -m pytest
 Note: Run this file from the parent directory (outside test folder)
 """
 
+import copy
+import hashlib
 import json
+import os
+import pytest
+import select
+import signal
+import sqlite3
 import subprocess
+import tarfile
 import tempfile
+import threading
+import time
+from config_converter.config_archive import config_archive
+from config_converter.config_checkpoint import config_checkpoint
+from config_converter.config_corpus import config_corpus
+from config_converter.config_io import config_io
+from config_converter.config_mapper import config_mapper
+from config_converter.config_prescan import config_prescan
+from config_converter.config_shard import config_shard
+from config_converter.config_watch import config_watch
 
 
 def read_file(path):
@@ -16,6 +34,13 @@ def read_file(path):
         return f.read()
 
 
+def read_line(stream, timeout=30):
+    """Reads a line from stream, failing if none arrives within timeout
+    seconds."""
+    assert select.select([stream], [], [], timeout)[0], 'no line in time'
+    return stream.readline()
+
+
 def check_stats(output_str, expected_stats):
     """Checks stats printed out are correct."""
     output_stats = output_str.strip()
@@ -38,7 +63,14 @@ def check_equality(config_name):
 def test_types():
     for prg in {
             'config_script.py',
-            'config_converter/config_mapper/config_mapper.py'
+            'config_converter/config_mapper/config_mapper.py',
+            'config_converter/config_prescan/config_prescan.py',
+            'config_converter/config_archive/config_archive.py',
+            'config_converter/config_checkpoint/config_checkpoint.py',
+            'config_converter/config_corpus/config_corpus.py',
+            'config_converter/config_io/config_io.py',
+            'config_converter/config_shard/config_shard.py',
+            'config_converter/config_watch/config_watch.py'
     }:
         subprocess.run(['python3', '-B', '-m', 'pytype', prg], check=True)
 
@@ -242,3 +274,509 @@ def test_in_tail_cli(capfd):
         'error_logs': 0
     }
     check_stats(capfd.readouterr().out, expected_stats)
+
+
+def test_write_to_yaml_skips_unchanged():
+    result = {'logs_module': {}, 'logging_level': 'info'}
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        assert config_mapper.write_to_yaml(result, tmpdirname, 'out')
+        mtime = os.stat(f'{tmpdirname}/out.yaml').st_mtime_ns
+        assert not config_mapper.write_to_yaml(result, tmpdirname, 'out')
+        assert os.stat(f'{tmpdirname}/out.yaml').st_mtime_ns == mtime
+        result['logging_level'] = 'warn'
+        assert config_mapper.write_to_yaml(result, tmpdirname, 'out')
+        assert os.listdir(tmpdirname) == ['out.yaml']
+        assert read_file(f'{tmpdirname}/out.yaml') == \
+            config_mapper.dump_yaml(result)
+
+
+def test_atomic_write():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = f'{tmpdirname}/out.json'
+        with open(path, 'w') as f:
+            f.write('old')
+        os.chmod(path, 0o640)
+        with pytest.raises(RuntimeError):
+            with config_io.atomic_write(path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    f.write('partial')
+                raise RuntimeError()
+        assert read_file(path) == 'old'
+        assert os.listdir(tmpdirname) == ['out.json']
+        config_shard.write_json(path, {'new': 1})
+        assert json.loads(read_file(path)) == {'new': 1}
+        assert os.stat(path).st_mode & 0o777 == 0o640
+        assert os.listdir(tmpdirname) == ['out.json']
+
+
+def test_check_mode(capfd):
+    config_name = 'in_tail_normal'
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        cmd = [
+            'python3', '-B', '-m', 'config_script', '--check',
+            f'test/data/{config_name}.conf', tmpdirname
+        ]
+        assert subprocess.run(cmd, check=False).returncode == 1
+        assert not os.listdir(tmpdirname)
+        assert 'would change' in capfd.readouterr().out
+        subprocess.run(cmd[:4] + cmd[5:], check=True)
+        capfd.readouterr()
+        subprocess.run(cmd, check=True)
+        assert capfd.readouterr().out.startswith('unchanged')
+
+
+def test_archive_includes_expanded():
+    members = {
+        'host/td-agent.conf': b'@include conf.d/*.conf\n<match **>\n</match>\n',
+        'host/conf.d/a.conf': b'@include /shared/common.conf\n',
+        'host/conf.d/b.conf': b'<source>\n</source>\n',
+        'host/conf.d/c.conf': b'@include ../../shared/tail.conf # shared\n',
+        'shared/tail.conf': b'<source>\n@type tail\n</source>\n',
+        'shared/common.conf': b'<system>\n</system>'
+    }
+    assert config_archive.config_names(members, 'host/*.conf') == [
+        'host/td-agent.conf'
+    ]
+    assert config_archive.expand_includes(members, 'host/td-agent.conf') == (
+        '<system>\n</system>\n\n<source>\n</source>\n\n'
+        '<source>\n@type tail\n</source>\n\n\n<match **>\n</match>\n')
+
+
+def test_archive_input_and_output():
+    configs = ['in_tail_include', 'no_in_tail']
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with tarfile.open(f'{tmpdirname}/in.tar.gz', 'w:gz') as archive:
+            archive.add('test/data', arcname='host')
+        subprocess.run([
+            'python3', '-B', '-m', 'config_script', f'{tmpdirname}/in.tar.gz',
+            f'{tmpdirname}/out.zip'
+        ],
+                       check=True)
+        with config_archive.read_members(f'{tmpdirname}/out.zip') as members:
+            outputs = dict(members)
+    for config_name in configs:
+        expected = read_file(f'test/data/{config_name}.yaml')
+        assert outputs[f'host/{config_name}.yaml'].decode() == expected
+
+
+def test_archive_output_keeps_members():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        config_archive.write_archive(f'{tmpdirname}/out.tar',
+                                     {'other.yaml': b'kept'})
+        subprocess.run([
+            'python3', '-B', '-m', 'config_script',
+            'test/data/no_in_tail.conf', f'{tmpdirname}/out.tar'
+        ],
+                       check=True)
+        with config_archive.read_members(f'{tmpdirname}/out.tar') as members:
+            outputs = dict(members)
+    assert outputs == {
+        'other.yaml': b'kept',
+        'no_in_tail.yaml': read_file('test/data/no_in_tail.yaml').encode()
+    }
+
+
+def test_archive_members_read_lazily():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for suffix in ['tar', 'tar.gz', 'zip']:
+            path = f'{tmpdirname}/in.{suffix}'
+            config_archive.write_archive(path, {
+                'a.conf': b'@include b.conf\n',
+                'b.conf': b'<source>\n</source>'
+            })
+            with config_archive.read_members(path) as members:
+                assert 'b.conf' in members and 'c.conf' not in members
+                assert dict(members) == {
+                    'a.conf': b'@include b.conf\n',
+                    'b.conf': b'<source>\n</source>'
+                }
+            if suffix == 'tar.gz':
+                with pytest.raises(config_archive.ArchiveError):
+                    config_archive.read_members(path, max_bytes=10)
+            else:
+                config_archive.read_members(path, max_bytes=10).close()
+
+
+def test_archive_include_limits():
+    members = {
+        'a.conf': b'@include b.conf\n',
+        'b.conf': b'@include a.conf\n',
+        'c.conf': b'@include *.txt\n',
+        '1.txt': b'',
+        '2.txt': b''
+    }
+    with pytest.raises(config_archive.IncludeError, match='a.conf -> b.conf'):
+        config_archive.expand_includes(members, 'a.conf')
+    with pytest.raises(config_archive.IncludeError, match='nested deeper'):
+        config_archive.expand_includes(members, 'a.conf', max_depth=0)
+    with pytest.raises(config_archive.IncludeError, match='included files'):
+        config_archive.expand_includes(members, 'c.conf', max_files=2)
+    assert config_archive.expand_includes(members, 'c.conf',
+                                          max_files=3) == '\n\n'
+
+
+def test_include_cycle_fails_fast(capfd):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/cycle.conf', 'w') as f:
+            f.write('@include cycle.conf\n')
+        subprocess.run([
+            'python3', '-B', '-m', 'config_script', f'{tmpdirname}/cycle.conf',
+            tmpdirname
+        ],
+                       check=True,
+                       timeout=30)
+        assert not os.path.exists(f'{tmpdirname}/cycle.yaml')
+    assert 'include cycle' in capfd.readouterr().err
+
+
+def test_prescan_maps_unsupported_only():
+    config_obj = config_prescan.prescan_file('test/data/no_in_tail.conf')
+    (result, stats) = config_mapper.convert_directive(
+        config_obj, 'info', '/var/log/ops_agent/ops_agent.log')
+    assert config_mapper.dump_yaml(result) == read_file(
+        'test/data/no_in_tail.yaml')
+    assert stats['entities_num'] == 2 and stats['attributes_num'] == 5
+    for config_name in ['in_tail_normal', 'in_tail_include']:
+        assert config_prescan.prescan_file(
+            f'test/data/{config_name}.conf') is None
+    for text in [
+            '<source>\n@type forward\n</source>\n@include a.conf\n',
+            '<match **>\npath "#{ENV[\'HOME\']}"\n</match>\n',
+            '<match **>\nkeys [\n  a\n]\n</match>\n', '<match **>\n'
+    ]:
+        assert config_prescan.prescan_text(text) is None
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/tail.conf', 'w') as f:
+            f.write(read_file('test/data/in_tail_normal.conf'))
+        for include in ['tail.conf # shared', 'missing.conf']:
+            with open(f'{tmpdirname}/main.conf', 'w') as f:
+                f.write(f'@include {include}\n')
+            assert config_prescan.prescan_file(
+                f'{tmpdirname}/main.conf') is None
+    assert config_archive.include_target(
+        '@include "conf.d/*.conf"  # shared\n') == 'conf.d/*.conf'
+
+
+def test_prescan_matches_parser(capfd):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for flags in [[], ['--no_prescan']]:
+            subprocess.run(['python3', '-B', '-m', 'config_script'] + flags +
+                           ['test/data/no_in_tail.conf', tmpdirname],
+                           check=True)
+            assert read_file(f'{tmpdirname}/no_in_tail.yaml') == read_file(
+                'test/data/no_in_tail.yaml')
+        (scanned, parsed) = capfd.readouterr().out.split('}\n', 1)
+    assert json.loads(scanned + '}') == json.loads(parsed)
+
+
+def test_checkpoints_migrated():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        logs = dict()
+        for name in ['kept', 'rotated', 'truncated']:
+            logs[name] = f'{tmpdirname}/{name}.log'
+            with open(logs[name], 'wt') as f:
+                f.write('line\n' * 10)
+        inode = {name: os.stat(path).st_ino for name, path in logs.items()}
+        pos_lines = [
+            (logs['kept'], 20, inode['kept']),
+            (logs['kept'], 30, inode['kept']),
+            (logs['rotated'], 5, inode['rotated'] + 1),
+            (logs['truncated'], 100, inode['truncated']),
+            (f'{tmpdirname}/missing.log', 5, 1),
+            (f'{tmpdirname}/unwatched.log', 0xffffffffffffffff, 2)
+        ]
+        with open(f'{tmpdirname}/td.pos', 'wt') as f:
+            f.writelines(f'{path}\t{offset:016x}\t{ino:016x}\n'
+                         for (path, offset, ino) in pos_lines)
+        result = {
+            'logs_module': {
+                'sources': [{
+                    'name': name,
+                    'type': 'file',
+                    'file_source_config': {
+                        'checkpoint_file': f'{tmpdirname}/{pos}'
+                    }
+                } for (name, pos) in [('td', 'td.pos'), ('gone', 'no.pos')]]
+            }
+        }
+        stats = dict()
+        config_checkpoint.migrate_sources(copy.deepcopy(result),
+                                          f'{tmpdirname}/out',
+                                          stats,
+                                          write=False)
+        assert not os.path.exists(f'{tmpdirname}/out')
+        assert stats['checkpoint_files_migrated'] == 1
+        stats = dict()
+        migrated = copy.deepcopy(result)
+        config_checkpoint.migrate_sources(migrated, f'{tmpdirname}/out',
+                                          stats)
+        checkpoint = migrated['logs_module']['sources'][0][
+            'file_source_config']['checkpoint_file']
+        assert os.path.dirname(checkpoint) == f'{tmpdirname}/out'
+        mtime = os.stat(checkpoint).st_mtime_ns
+        db = sqlite3.connect(checkpoint)
+        assert db.execute(
+            'SELECT name, offset, inode FROM in_tail_files').fetchall() == [
+                (logs['kept'], 30, inode['kept'])
+            ]
+        db.close()
+        kept = dict()
+        config_checkpoint.migrate_sources(copy.deepcopy(result),
+                                          f'{tmpdirname}/out', kept)
+        assert kept['checkpoints'][0]['kept'] == 'checkpoint exists'
+        assert (kept['checkpoints_kept'],
+                kept['checkpoint_files_migrated']) == (1, 0)
+        assert os.stat(checkpoint).st_mtime_ns == mtime
+        forced = dict()
+        config_checkpoint.migrate_sources(copy.deepcopy(result),
+                                          f'{tmpdirname}/out',
+                                          forced,
+                                          overwrite=True)
+        assert (forced['checkpoints_kept'],
+                forced['checkpoint_files_migrated']) == (0, 1)
+    assert stats['checkpoints'][0]['files_skipped'] == {
+        logs['rotated']: 'rotated',
+        logs['truncated']: 'truncated',
+        f'{tmpdirname}/missing.log': 'missing'
+    }
+    assert 'error' in stats['checkpoints'][1]
+    assert (stats['checkpoints_migrated'], stats['checkpoints_failed'],
+            stats['checkpoint_files_migrated'],
+            stats['checkpoint_files_skipped']) == (1, 1, 1, 3)
+
+
+def test_checkpoint_dir_cli():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/td.log', 'wt') as f:
+            f.write('line\n' * 10)
+        with open(f'{tmpdirname}/td.pos', 'wt') as f:
+            f.write(f'{tmpdirname}/td.log\t{20:016x}\t'
+                    f'{os.stat(f"{tmpdirname}/td.log").st_ino:016x}\n')
+        with open(f'{tmpdirname}/tail.conf', 'wt') as f:
+            f.write(
+                read_file('test/data/in_tail_normal.conf').replace(
+                    '/var/log/fluentd_test', f'{tmpdirname}/td'))
+        os.mkdir(f'{tmpdirname}/out')
+        cmd = [
+            'python3', '-B', '-m', 'config_script', '--check',
+            f'--checkpoint_dir={tmpdirname}/ckpt', f'{tmpdirname}/tail.conf',
+            f'{tmpdirname}/out'
+        ]
+        assert subprocess.run(cmd, check=False).returncode == 1
+        assert not os.path.exists(f'{tmpdirname}/ckpt')
+        assert not os.listdir(f'{tmpdirname}/out')
+        subprocess.run([arg for arg in cmd if arg != '--check'], check=True)
+        checkpoint = f'{tmpdirname}/ckpt/' + config_checkpoint.checkpoint_name(
+            f'{tmpdirname}/td.pos')
+        assert f'checkpoint_file: {checkpoint}\n' in read_file(
+            f'{tmpdirname}/out/tail.yaml')
+        db = sqlite3.connect(checkpoint)
+        assert db.execute('SELECT name, offset FROM in_tail_files').fetchall(
+        ) == [(f'{tmpdirname}/td.log', 20)]
+        db.close()
+
+
+def test_corpus_diff_values():
+    expected = {'a': {'b': [1, {'c': 'x'}], 'd': 1}, 'e': 2}
+    assert config_corpus.diff_values(expected, expected) == []
+    observed = {'a': {'b': [1, {'c': 'y'}, 3]}, 'e': 2, 'f': None}
+    assert config_corpus.diff_values(expected, observed) == [
+        "a.b[1].c: expected 'x', got 'y'", 'a.b[2]: unexpected 3',
+        'a.d: missing, expected 1', 'f: unexpected None'
+    ]
+
+
+def test_corpus_run(capfd):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        os.makedirs(f'{tmpdirname}/corpus/sub')
+        for (name, yaml_text) in [
+            ('broken', 'logs_module: [\n'),
+            ('no_in_tail', read_file('test/data/no_in_tail.yaml')),
+            ('sub/changed',
+             read_file('test/data/no_in_tail.yaml').replace('info', 'warn'))
+        ]:
+            with open(f'{tmpdirname}/corpus/{name}.conf', 'wt') as f:
+                f.write(read_file('test/data/no_in_tail.conf'))
+            with open(f'{tmpdirname}/corpus/{name}.yaml', 'wt') as f:
+                f.write(yaml_text)
+        with open(f'{tmpdirname}/corpus/include.conf', 'wt') as f:
+            f.write('<match **>\n</match>\n')
+        os.makedirs(f'{tmpdirname}/out')
+        cmd = [
+            'python3', '-B', '-m', 'config_script', '--corpus',
+            f'{tmpdirname}/corpus', f'{tmpdirname}/out'
+        ]
+        assert subprocess.run(cmd, check=False).returncode == 1
+        assert os.listdir(f'{tmpdirname}/out/sub') == ['changed.yaml']
+        assert sorted(os.listdir(
+            f'{tmpdirname}/out')) == ['broken.yaml', 'sub']
+        lines = capfd.readouterr().out.splitlines()
+        subprocess.run(cmd + ['--corpus_workers=0'], check=True)
+        assert '--corpus_workers must be at least 1' in capfd.readouterr().out
+    assert [line.rsplit(' ', 1)[0] for line in lines[:1] + lines[2:4]] == [
+        'FAIL broken', 'ok no_in_tail', 'FAIL sub/changed'
+    ]
+    assert lines[1].startswith('    invalid fixture broken: ')
+    assert lines[4] == "    logging_level: expected 'warn', got 'info'"
+    assert lines[5].startswith('1 of 3 fixtures passed')
+
+
+def test_shards_partition_entries():
+    entries = [f'host{i}/td-agent.conf' for i in range(100)]
+    shards = [config_shard.select_shard(entries, i, 4) for i in range(4)]
+    assert sorted(sum(shards, [])) == sorted(entries)
+    assert all(shards)
+    assert shards == [
+        config_shard.select_shard(entries, i, 4) for i in range(4)
+    ]
+
+
+def test_merge_shard_results():
+    stats = {'attributes_num': 2, 'error_logs': 1}
+    results = [{
+        'shard': i,
+        'shards': 3,
+        'manifest_sha256': 'abc',
+        'configs': {
+            f'{i}.conf': {
+                'stats': stats,
+                'changed': i == 0,
+                'sha256': ''
+            }
+        }
+    } for i in range(2)]
+    results[1]['configs']['bad.conf'] = {'error': 'failed to parse'}
+    report = config_shard.merge_results(results)
+    assert report['stats'] == {'attributes_num': 4, 'error_logs': 2}
+    assert (report['configs_num'], report['configs_converted'],
+            report['configs_failed'], report['configs_changed']) == (3, 2, 1,
+                                                                    1)
+    assert report['failures'] == {'bad.conf': 'failed to parse'}
+    assert report['shards_missing'] == [2]
+    with pytest.raises(config_shard.ShardError):
+        config_shard.merge_results(results + results[:1])
+
+
+def test_shards_run_and_merge():
+    configs = ['in_tail_normal', 'in_tail_double', 'no_in_tail', 'in_tail_cli']
+    count = 3
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/manifest.txt', 'w') as f:
+            f.writelines(f'{os.getcwd()}/test/data/{name}.conf\n'
+                         for name in configs)
+        runs = [
+            subprocess.Popen([
+                'python3', '-B', '-m', 'config_script', f'--shard={i}/{count}',
+                f'{tmpdirname}/manifest.txt', tmpdirname
+            ],
+                             stdout=subprocess.DEVNULL) for i in range(count)
+        ]
+        assert all(run.wait() == 0 for run in runs)
+        subprocess.run([
+            'python3', '-B', '-m', 'config_converter.config_shard.config_shard',
+            f'{tmpdirname}/report.json'
+        ] + [f'{tmpdirname}/shard-{i}-of-{count}.json' for i in range(count)],
+                       check=True)
+        with open(f'{tmpdirname}/report.json', 'rt') as f:
+            report = json.load(f)
+        assert (report['configs_num'], report['configs_failed'],
+                report['shards_missing']) == (len(configs), 0, [])
+        for config in report['configs'].values():
+            observed = read_file(f'{tmpdirname}/{config["output"]}')
+            assert config['sha256'] == hashlib.sha256(
+                observed.encode()).hexdigest()
+
+
+def test_shard_check_writes_nothing(capfd):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/manifest.txt', 'w') as f:
+            f.write(f'{os.getcwd()}/test/data/no_in_tail.conf\n')
+        cmd = [
+            'python3', '-B', '-m', 'config_script', '--check', '--shard=0/1',
+            f'{tmpdirname}/manifest.txt'
+        ]
+        assert subprocess.run(cmd + [tmpdirname],
+                              check=False).returncode == 1
+        assert os.listdir(tmpdirname) == ['manifest.txt']
+        capfd.readouterr()
+        subprocess.run(cmd + [f'{tmpdirname}/out.tar'], check=True)
+        assert 'shards cannot share an archive' in capfd.readouterr().out
+        assert os.listdir(tmpdirname) == ['manifest.txt']
+
+
+def test_include_closure():
+    (files, patterns) = config_watch.include_closure(
+        'test/data/in_tail_include.conf')
+    assert files == {
+        os.path.abspath(f'test/data/{name}.conf') for name in
+        ['in_tail_include', 'in_tail_deprecated', 'in_tail_unknown']
+    }
+    assert not patterns
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/main.conf', 'w') as f:
+            f.write('@include tail.conf # shared\n')
+        assert config_watch.include_closure(f'{tmpdirname}/main.conf') == ({
+            f'{tmpdirname}/main.conf', f'{tmpdirname}/tail.conf'
+        }, set())
+
+
+def test_watch_changes_coalesced():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for use_inotify in [True, False]:
+            watcher = config_watch.create_watcher(0.05, use_inotify)
+            watcher.set_dirs({tmpdirname})
+
+            def edit():
+                for i in range(3):
+                    with open(f'{tmpdirname}/{i}.conf', 'a') as f:
+                        f.write('edit')
+                    time.sleep(0.02)
+
+            threading.Timer(0.1, edit).start()
+            (changed, _) = config_watch.wait_for_changes(watcher, 0.2, 2)
+            watcher.close()
+            assert changed == {f'{tmpdirname}/{i}.conf' for i in range(3)}
+
+
+def test_watch_survives_recreated_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        conf_dir = f'{tmpdirname}/conf.d'
+        os.mkdir(conf_dir)
+        watcher = config_watch.create_watcher(0.05)
+        watcher.set_dirs({conf_dir})
+        os.rmdir(conf_dir)
+        changed = watcher.read(2)
+        assert config_watch.affected(changed, {f'{conf_dir}/a.conf'}, set())
+        assert config_watch.watched_dirs({f'{conf_dir}/a.conf'},
+                                         set()) == {tmpdirname}
+        os.mkdir(conf_dir)
+        watcher.set_dirs({conf_dir})
+        with open(f'{conf_dir}/a.conf', 'w') as f:
+            f.write('edit')
+        assert f'{conf_dir}/a.conf' in watcher.read(2)
+        watcher.close()
+
+
+def test_watch_reconverts_on_include_change():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(f'{tmpdirname}/main.conf', 'w') as f:
+            f.write('@include conf.d/*.conf\n')
+        os.mkdir(f'{tmpdirname}/conf.d')
+        watch = subprocess.Popen([
+            'python3', '-B', '-m', 'config_script', '--watch',
+            f'{tmpdirname}/main.conf', tmpdirname
+        ],
+                                 stdout=subprocess.PIPE,
+                                 text=True)
+        try:
+            first = json.loads(read_line(watch.stdout))
+            assert first['stats']['entities_num'] == 0
+            with open(f'{tmpdirname}/conf.d/tail.conf', 'w') as f:
+                f.write(read_file('test/data/in_tail_normal.conf'))
+            second = json.loads(read_line(watch.stdout))
+            assert second['changed'] and 'latency_ms' in second
+            assert read_file(f'{tmpdirname}/main.yaml') == read_file(
+                'test/data/in_tail_normal.yaml')
+        finally:
+            watch.send_signal(signal.SIGINT)
+            watch.wait(timeout=10)